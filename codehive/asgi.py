@@ -9,6 +9,11 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codehive.settings')
 django_asgi_app = get_asgi_application()
 
 import codehive.routing
+from django.conf import settings
+
+if settings.EXECUTION_RECOVERY_ENABLED:
+    from execution.tasks import start_recovery
+    start_recovery()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -0,0 +1,196 @@
+"""
+In-process metrics registry exposed in the Prometheus text format.
+
+Counters and histograms are kept per worker process; scrape each worker
+(or run a single worker) to get complete numbers.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """Holds every metric so they can be rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}',
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_sample(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}']
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            if index < len(self.buckets):
+                state['buckets'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the wrapped block, even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['buckets']):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', repr(float(bound))))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key, ('le', '+Inf'))
+        lines.append(f'{self.name}_bucket{labels} {state["count"]}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {state["sum"]}')
+        lines.append(f'{self.name}_count{labels} {state["count"]}')
+        return lines
+
+
+# Game engine
+GEMINI_REQUEST_DURATION = Histogram(
+    'codehive_gemini_request_duration_seconds',
+    'Latency of Gemini generate_content calls.',
+    ['operation'],
+)
+GEMINI_REQUEST_ERRORS = Counter(
+    'codehive_gemini_request_errors_total',
+    'Gemini generate_content calls that raised.',
+    ['operation'],
+)
+DIFFUSION_RENDER_DURATION = Histogram(
+    'codehive_diffusion_render_duration_seconds',
+    'Wall time spent rendering a batch of character portraits.',
+    ['status'],
+)
+DIFFUSION_BATCH_SIZE = Histogram(
+    'codehive_diffusion_batch_size',
+    'Number of portraits rendered per diffusion pipeline call.',
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+
+# HTTP views
+VIEW_DURATION = Histogram(
+    'codehive_view_duration_seconds',
+    'Total time spent handling a request, per view.',
+    ['view', 'method', 'status'],
+)
+VIEW_DB_DURATION = Histogram(
+    'codehive_view_db_duration_seconds',
+    'Time spent in ORM queries while handling a request, per view.',
+    ['view'],
+)
+VIEW_DB_QUERIES = Counter(
+    'codehive_view_db_queries_total',
+    'Number of ORM queries executed, per view.',
+    ['view'],
+)
+
+# Caches
+CACHE_REQUESTS = Counter(
+    'codehive_cache_requests_total',
+    'Cache lookups by cache name and result (hit or miss).',
+    ['cache', 'result'],
+)
+
+# Code execution
+EXECUTION_DURATION = Histogram(
+    'codehive_execution_duration_seconds',
+    'Time an execution spent in its backend, including container or process setup.',
+    ['backend', 'status'],
+)
+
+
+def record_cache_lookup(cache, hit):
+    """Count a cache lookup as a hit or a miss"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
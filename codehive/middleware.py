@@ -0,0 +1,72 @@
+import re
+import time
+from django.db import connections
+from . import metrics, tracing
+
+TRACE_ID_PATTERN = re.compile(r'^[0-9a-fA-F-]{8,64}$')
+
+
+class MetricsMiddleware:
+    """
+    Record request latency and ORM time for every view
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        db_time = [0.0]
+        db_queries = [0]
+
+        def timed_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db_time[0] += time.perf_counter() - start
+                db_queries[0] += 1
+
+        start = time.perf_counter()
+        wrappers = [connection.execute_wrapper(timed_query) for connection in connections.all()]
+        for wrapper in wrappers:
+            wrapper.__enter__()
+        try:
+            response = self.get_response(request)
+        finally:
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        metrics.VIEW_DURATION.observe(
+            time.perf_counter() - start,
+            view=view,
+            method=request.method,
+            status=response.status_code
+        )
+        metrics.VIEW_DB_DURATION.observe(db_time[0], view=view)
+        metrics.VIEW_DB_QUERIES.inc(db_queries[0], view=view)
+
+        return response
+
+
+class TracingMiddleware:
+    """
+    Open a root span per request and return its trace ID in a response header.
+    A valid incoming trace ID header is continued instead of starting a new trace.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trace_id = request.headers.get(tracing.TRACE_HEADER, '')
+        if not TRACE_ID_PATTERN.match(trace_id):
+            trace_id = None
+
+        with tracing.trace(f'{request.method} {request.path}', trace_id=trace_id) as root:
+            response = self.get_response(request)
+            root.set_attribute('http.status_code', response.status_code)
+
+        response[tracing.TRACE_HEADER] = root.trace_id
+        return response
\ No newline at end of file
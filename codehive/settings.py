@@ -38,6 +38,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # CORS should be at the top
+    'codehive.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,6 +46,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'codehive.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'codehive.urls'
@@ -91,6 +93,21 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache configuration
+# 'shared' lives in Redis and is seen by every worker; 'default' stays per process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv(
+            'CACHE_REDIS_URL',
+            f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/1"
+        ),
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -163,6 +180,153 @@ JWT_SECRET = os.getenv('JWT_SECRET', SECRET_KEY)
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_DELTA = 60 * 60 * 24  # 24 hours
 
+# File version settings
+# Versions are stored as deltas against the previous one, with a full
+# snapshot every FILE_VERSION_SNAPSHOT_INTERVAL versions
+FILE_VERSION_SNAPSHOT_INTERVAL = int(os.getenv('FILE_VERSION_SNAPSHOT_INTERVAL', 20))
+# Versions per page of a file's history; content is fetched per version
+FILE_VERSION_PAGE_SIZE = int(os.getenv('FILE_VERSION_PAGE_SIZE', 20))
+
+# Bulk uploads: most files, and most bytes of uncompressed content, per upload
+BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', 5000))
+BULK_UPLOAD_MAX_BYTES = int(os.getenv('BULK_UPLOAD_MAX_BYTES', 50 * 1024 * 1024))
+
+# Resolved project roles are cached for PROJECT_ROLE_CACHE_TTL seconds in the
+# PROJECT_ROLE_CACHE cache alias, which must be shared between workers so
+# that changing a collaborator takes effect everywhere; with a per-process
+# cache (or none) roles are only reused within a request
+PROJECT_ROLE_CACHE = os.getenv('PROJECT_ROLE_CACHE', 'shared')
+PROJECT_ROLE_CACHE_TTL = int(os.getenv('PROJECT_ROLE_CACHE_TTL', 60))
+
+# Live editing: seconds between saves of edited documents to their File, and
+# operations kept per document for rebasing edits made on older revisions
+FILE_EDIT_PERSIST_INTERVAL = float(os.getenv('FILE_EDIT_PERSIST_INTERVAL', 5.0))
+FILE_EDIT_HISTORY_SIZE = int(os.getenv('FILE_EDIT_HISTORY_SIZE', 500))
+
+# Cursor and selection updates are coalesced per user and file and broadcast
+# at most once per CURSOR_BROADCAST_INTERVAL seconds
+CURSOR_BROADCAST_INTERVAL = float(os.getenv('CURSOR_BROADCAST_INTERVAL', 0.05))
+
+# Execution backend: 'docker', or 'local' to run commands as rlimited
+# subprocesses of the server. Projects listed (comma-separated ids) in
+# EXECUTION_LOCAL_PROJECTS always use the local backend
+EXECUTION_BACKEND = os.getenv('EXECUTION_BACKEND', 'docker')
+EXECUTION_LOCAL_PROJECTS = [project_id for project_id in os.getenv('EXECUTION_LOCAL_PROJECTS', '').split(',') if project_id]
+# Local backend: parent directory of the per-run temp dirs (system default
+# when empty), largest file a run may write, and the process limit, which
+# counts every process of the user the server runs as
+EXECUTION_LOCAL_ROOT = os.getenv('EXECUTION_LOCAL_ROOT', '')
+EXECUTION_LOCAL_MAX_FILE_SIZE = os.getenv('EXECUTION_LOCAL_MAX_FILE_SIZE', '64m')
+EXECUTION_LOCAL_MAX_PROCESSES = int(os.getenv('EXECUTION_LOCAL_MAX_PROCESSES', 512))
+
 # Docker settings
 DOCKER_BASE_URL = os.getenv('DOCKER_BASE_URL', 'unix://var/run/docker.sock')
-CODE_EXECUTION_TIMEOUT = int(os.getenv('CODE_EXECUTION_TIMEOUT', 30))
\ No newline at end of file
+CODE_EXECUTION_TIMEOUT = int(os.getenv('CODE_EXECUTION_TIMEOUT', 30))
+EXECUTION_IMAGE = os.getenv('EXECUTION_IMAGE', 'python:3.9-slim')
+
+# Host directory caching each project's files between executions
+EXECUTION_WORKSPACE_ROOT = os.getenv('EXECUTION_WORKSPACE_ROOT', os.path.join(BASE_DIR, 'workspaces'))
+
+# Executions running at once, overall and per user / per project; further
+# runs wait in a fair queue
+EXECUTION_MAX_CONCURRENT = int(os.getenv('EXECUTION_MAX_CONCURRENT', 4))
+EXECUTION_MAX_PER_USER = int(os.getenv('EXECUTION_MAX_PER_USER', 2))
+EXECUTION_MAX_PER_PROJECT = int(os.getenv('EXECUTION_MAX_PER_PROJECT', 2))
+
+# The caps above hold across processes through leases in Redis; a lease
+# expires EXECUTION_SLOT_TTL seconds after its process stops refreshing it,
+# and runs held back by another process's leases are retried every
+# EXECUTION_SLOT_RETRY_INTERVAL seconds. An empty URL keeps the caps per process
+EXECUTION_SLOTS_REDIS_URL = os.getenv(
+    'EXECUTION_SLOTS_REDIS_URL',
+    f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/0"
+)
+EXECUTION_SLOT_TTL = float(os.getenv('EXECUTION_SLOT_TTL', 30))
+EXECUTION_SLOT_RETRY_INTERVAL = float(os.getenv('EXECUTION_SLOT_RETRY_INTERVAL', 1.0))
+
+# The execution queue is kept in memory; every EXECUTION_RECOVERY_INTERVAL
+# seconds each process marks its runs as alive, fails runs left 'running' by a
+# process that is gone and queues its pending runs again
+EXECUTION_RECOVERY_ENABLED = os.getenv('EXECUTION_RECOVERY_ENABLED', 'True') == 'True'
+EXECUTION_RECOVERY_INTERVAL = int(os.getenv('EXECUTION_RECOVERY_INTERVAL', 30))
+
+# Warm container pool: containers kept started and idle (each serves one
+# execution), and maximum container lifetime in seconds
+EXECUTION_POOL_SIZE = int(os.getenv('EXECUTION_POOL_SIZE', 4))
+EXECUTION_POOL_MAX_AGE = int(os.getenv('EXECUTION_POOL_MAX_AGE', 3600))
+
+# Resource limits for every execution container
+EXECUTION_MEMORY_LIMIT = os.getenv('EXECUTION_MEMORY_LIMIT', '512m')
+EXECUTION_CPU_LIMIT = float(os.getenv('EXECUTION_CPU_LIMIT', 1.0))
+EXECUTION_PIDS_LIMIT = int(os.getenv('EXECUTION_PIDS_LIMIT', 128))
+
+# Images with a project's requirements.txt preinstalled: repository they are
+# tagged in, idle containers kept per image, pip install timeout (seconds),
+# and when unused images are removed (after EXECUTION_DEPS_IMAGE_TTL seconds
+# without use, or beyond the EXECUTION_DEPS_MAX_IMAGES most recently used)
+EXECUTION_DEPS_REPOSITORY = os.getenv('EXECUTION_DEPS_REPOSITORY', 'codehive-deps')
+EXECUTION_DEPS_POOL_SIZE = int(os.getenv('EXECUTION_DEPS_POOL_SIZE', 1))
+EXECUTION_DEPS_BUILD_TIMEOUT = int(os.getenv('EXECUTION_DEPS_BUILD_TIMEOUT', 600))
+EXECUTION_DEPS_IMAGE_TTL = int(os.getenv('EXECUTION_DEPS_IMAGE_TTL', 7 * 24 * 3600))
+EXECUTION_DEPS_MAX_IMAGES = int(os.getenv('EXECUTION_DEPS_MAX_IMAGES', 50))
+EXECUTION_DEPS_GC_INTERVAL = int(os.getenv('EXECUTION_DEPS_GC_INTERVAL', 3600))
+
+# Docker network requirements are installed on; point it at a network that
+# can only reach the package index
+EXECUTION_DEPS_NETWORK = os.getenv('EXECUTION_DEPS_NETWORK', 'bridge')
+
+# Seconds between docker stats samples while an execution runs
+EXECUTION_STATS_INTERVAL = float(os.getenv('EXECUTION_STATS_INTERVAL', 0.5))
+
+# Live execution output: seconds between pushes to the project channel, and
+# how often (seconds) or after how many bytes buffered output is saved
+EXECUTION_OUTPUT_PUSH_INTERVAL = float(os.getenv('EXECUTION_OUTPUT_PUSH_INTERVAL', 0.2))
+EXECUTION_OUTPUT_FLUSH_INTERVAL = float(os.getenv('EXECUTION_OUTPUT_FLUSH_INTERVAL', 2.0))
+EXECUTION_OUTPUT_FLUSH_BYTES = int(os.getenv('EXECUTION_OUTPUT_FLUSH_BYTES', 64 * 1024))
+
+# Stored output per stream is capped at EXECUTION_LOG_MAX_BYTES; execution
+# rows and their WebSocket updates carry only the last EXECUTION_LOG_TAIL_CHARS
+EXECUTION_LOG_MAX_BYTES = int(os.getenv('EXECUTION_LOG_MAX_BYTES', 5 * 1024 * 1024))
+EXECUTION_LOG_TAIL_CHARS = int(os.getenv('EXECUTION_LOG_TAIL_CHARS', 4096))
+
+# Presence settings
+# Active users per project room live in Redis; every connection heartbeats
+# each PRESENCE_HEARTBEAT_INTERVAL seconds and is dropped after PRESENCE_TTL
+PRESENCE_REDIS_URL = os.getenv(
+    'PRESENCE_REDIS_URL',
+    f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/0"
+)
+PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv('PRESENCE_HEARTBEAT_INTERVAL', 15))
+PRESENCE_TTL = float(os.getenv('PRESENCE_TTL', 45))
+
+# Metrics settings
+# When set, /metrics/ requires an 'Authorization: Bearer <token>' header;
+# otherwise only staff users can read it unless METRICS_PUBLIC is 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', 'False') == 'True'
+
+# Tracing settings
+# Finished spans are appended as JSON lines to TRACE_FILE_PATH and/or POSTed
+# to TRACE_COLLECTOR_URL; tracing export is off when both are empty
+TRACE_FILE_PATH = os.getenv('TRACE_FILE_PATH', '')
+TRACE_COLLECTOR_URL = os.getenv('TRACE_COLLECTOR_URL', '')
+
+# Game image settings
+# Rendered portraits are stored per session under content-hashed names
+GAME_IMAGE_ROOT = os.getenv('GAME_IMAGE_ROOT', os.path.join(BASE_DIR, 'media', 'game_images'))
+GAME_IMAGE_THUMBNAIL_SIZE = int(os.getenv('GAME_IMAGE_THUMBNAIL_SIZE', 256))
+GAME_IMAGE_WEBP_QUALITY = int(os.getenv('GAME_IMAGE_WEBP_QUALITY', 85))
+# Native pixel-art portraits: palette size, and the block size assumed when no grid is detected (0 keeps full size)
+GAME_IMAGE_PALETTE_SIZE = int(os.getenv('GAME_IMAGE_PALETTE_SIZE', 32))
+GAME_IMAGE_DEFAULT_PIXEL_SIZE = int(os.getenv('GAME_IMAGE_DEFAULT_PIXEL_SIZE', 8))
+GAME_IMAGE_KEEP_ORIGINAL = os.getenv('GAME_IMAGE_KEEP_ORIGINAL', 'False') == 'True'
+GAME_IMAGE_CACHE_MAX_AGE = 60 * 60 * 24 * 365  # 1 year, image names never change
+
+# Image worker settings
+# Portrait jobs arriving within the window are rendered in one batched pipeline call
+IMAGE_BATCH_WINDOW_MS = int(os.getenv('IMAGE_BATCH_WINDOW_MS', 250))
+IMAGE_BATCH_MAX_SIZE = int(os.getenv('IMAGE_BATCH_MAX_SIZE', 4))
+# Scene creation waits this long for a portrait before serving a placeholder, and
+# doesn't wait at all once this many jobs are queued
+IMAGE_RENDER_WAIT_SECONDS = float(os.getenv('IMAGE_RENDER_WAIT_SECONDS', 3))
+IMAGE_QUEUE_SATURATION = int(os.getenv('IMAGE_QUEUE_SATURATION', 8))
\ No newline at end of file
@@ -0,0 +1,196 @@
+"""
+Lightweight request tracing.
+
+Spans are opened with ``span('name')`` and nest through a context variable,
+so every span created while handling a request shares that request's trace
+ID. Finished spans are handed to a background exporter that appends them as
+JSON lines to TRACE_FILE_PATH and/or POSTs them to TRACE_COLLECTOR_URL.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = 'X-Trace-Id'
+
+_current_span = contextvars.ContextVar('codehive_current_span', default=None)
+_current_trace_id = contextvars.ContextVar('codehive_trace_id', default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class SpanExporter:
+    """Ships finished spans off the request thread in small batches"""
+
+    def __init__(self, file_path='', collector_url='', batch_size=100, flush_interval=1.0):
+        self.file_path = file_path
+        self.collector_url = collector_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.file_path or self.collector_url)
+
+    def export(self, span):
+        if not self.enabled:
+            return
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            # Never block a request because the exporter fell behind
+            pass
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        if self.file_path:
+            try:
+                with open(self.file_path, 'a', encoding='utf-8') as f:
+                    for item in batch:
+                        f.write(json.dumps(item) + '\n')
+            except OSError as e:
+                logger.warning(f"Could not write spans to {self.file_path}: {e}")
+
+        if self.collector_url:
+            request = urllib.request.Request(
+                self.collector_url,
+                data=json.dumps({'spans': batch}).encode('utf-8'),
+                headers={'Content-Type': 'application/json'},
+                method='POST'
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.warning(f"Could not send spans to {self.collector_url}: {e}")
+
+
+_exporter = None
+
+
+def get_exporter():
+    global _exporter
+    if _exporter is None:
+        _exporter = SpanExporter(
+            file_path=settings.TRACE_FILE_PATH,
+            collector_url=settings.TRACE_COLLECTOR_URL
+        )
+    return _exporter
+
+
+def current_trace_id():
+    return _current_trace_id.get()
+
+
+@contextmanager
+def trace(name, trace_id=None, **attributes):
+    """Start a new trace (or continue ``trace_id``) with a root span"""
+    token = _current_trace_id.set(trace_id or uuid.uuid4().hex)
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _current_trace_id.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block of work as a child of the current span.
+    Outside of a trace the span starts a fresh trace, which the spans
+    nested in it share.
+    """
+    parent = _current_span.get()
+    trace_id = _current_trace_id.get()
+    trace_token = None
+    if trace_id is None:
+        trace_id = uuid.uuid4().hex
+        trace_token = _current_trace_id.set(trace_id)
+    current = Span(name, trace_id, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = 'error'
+        current.set_attribute('error', str(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        if trace_token is not None:
+            _current_trace_id.reset(trace_token)
+        current.finish()
+        get_exporter().export(current)
+
+
+def traced(name):
+    """Decorator that wraps every call of a function in a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -2,9 +2,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from .views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name='metrics'),
     path('api/users/', include('users.urls')),
     path('api/projects/', include('projects.urls')),
     path('api/execution/', include('execution.urls')),
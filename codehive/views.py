@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from . import metrics
+
+
+def metrics_view(request):
+    """Expose all metrics in the Prometheus text format"""
+    token = settings.METRICS_TOKEN
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponseForbidden()
+    elif not settings.METRICS_PUBLIC and not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        metrics.REGISTRY.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
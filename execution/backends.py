@@ -0,0 +1,307 @@
+"""
+Backends that run an execution's command against a project's files.
+
+DockerBackend runs in pooled, resource-limited containers and is the
+default. LocalSubprocessBackend runs the command as a child process of the
+server, in a private temporary directory and under rlimits (CPU time,
+address space, file size, process count) and a wall-clock timeout. It starts
+in milliseconds but isolates far less than a container and ignores the
+project's requirements.txt, so only use it for trusted projects
+(EXECUTION_LOCAL_PROJECTS) or where Docker is not available.
+"""
+
+import io
+import os
+import selectors
+import shutil
+import signal
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from codehive import tracing
+from .dependencies import get_dependency_images
+from .pool import WORKDIR, get_container_pool
+from .usage import ResourceSampler, ResourceUsage
+
+# Seconds between SIGTERM and SIGKILL once a command runs out of time
+KILL_GRACE_PERIOD = 5
+# Seconds output is still read after the command exited; a process that left
+# its group (setsid) can hold the pipes open forever
+DRAIN_PERIOD = 1
+
+
+class RunResult:
+    def __init__(self, exit_code, timed_out, usage=None):
+        self.exit_code = exit_code
+        self.timed_out = timed_out
+        self.usage = usage
+
+    def apply(self, execution):
+        """Copy the exit code and resource usage onto an ExecutionResult"""
+        execution.exit_code = self.exit_code
+        if self.usage is not None:
+            self.usage.apply(execution)
+
+
+class ExecutionBackend:
+    name = None
+
+    def run(self, project_id, archive, command, output):
+        """
+        Run ``command`` against the project files in the tar ``archive``,
+        writing its output to ``output`` as it is produced, and return a
+        RunResult
+        """
+        raise NotImplementedError
+
+
+class DockerBackend(ExecutionBackend):
+    name = 'docker'
+
+    def run(self, project_id, archive, command, output):
+        # Use an image with the project's requirements preinstalled, if any
+        with tracing.span('dependency_image'):
+            image = get_dependency_images().image_for_project(project_id)
+
+        start = time.perf_counter()
+        with get_container_pool(image).lease() as pooled:
+            container = pooled.container
+            with tracing.span('container.put_archive'):
+                container.put_archive(WORKDIR, archive)
+
+            with tracing.span('container.exec'), ResourceSampler(container) as usage:
+                exit_code = self._stream_command(container, command, output)
+
+        return RunResult(exit_code, self._timed_out(exit_code, start), usage)
+
+    def _stream_command(self, container, command, output):
+        api = container.client.api
+        exec_id = api.exec_create(container.id, self._timeout_command(command), workdir=WORKDIR)['Id']
+        for stdout, stderr in api.exec_start(exec_id, stream=True, demux=True):
+            output.write('stdout', stdout)
+            output.write('stderr', stderr)
+        return api.exec_inspect(exec_id)['ExitCode']
+
+    def _timeout_command(self, command):
+        """
+        Wrap a command so it is stopped after CODE_EXECUTION_TIMEOUT seconds,
+        and killed if it ignores SIGTERM
+        """
+        return ['timeout', '-k', str(KILL_GRACE_PERIOD), str(settings.CODE_EXECUTION_TIMEOUT), 'sh', '-c', command]
+
+    def _timed_out(self, exit_code, start):
+        # timeout exits with 124, or 137 when the process had to be killed
+        if exit_code == 124:
+            return True
+        return exit_code == 137 and time.perf_counter() - start >= settings.CODE_EXECUTION_TIMEOUT
+
+
+# Applies the rlimits passed as arguments and runs the command in a child
+# process, then writes the child's peak RSS (KiB) to the given fd and exits
+# like it.
+# The wrapper is needed twice over: a preexec_fn is not fork-safe while the
+# server has other threads, and a process forked from the server inherits
+# its resident set in ru_maxrss.
+LIMITS_SCRIPT = '''
+import os, resource, signal, sys
+names = ('RLIMIT_CPU', 'RLIMIT_AS', 'RLIMIT_FSIZE', 'RLIMIT_NPROC')
+for name, value in zip(names, map(int, sys.argv[1:5])):
+    if value > 0:
+        resource.setrlimit(getattr(resource, name), (value, value))
+maxrss_fd = int(sys.argv[5])
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+pid = os.fork()
+if pid == 0:
+    os.close(maxrss_fd)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.execvp('sh', ['sh', '-c', sys.argv[6]])
+_, status, usage = os.wait4(pid, 0)
+os.write(maxrss_fd, str(usage.ru_maxrss).encode())
+code = os.waitstatus_to_exitcode(status)
+sys.exit(128 - code if code < 0 else code)
+'''
+
+
+def parse_size(value):
+    """Bytes in a Docker-style size such as '512m' or '1g'"""
+    value = str(value).strip().lower()
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value or 0)
+
+
+class LocalSubprocessBackend(ExecutionBackend):
+    name = 'local'
+
+    def run(self, project_id, archive, command, output):
+        workdir = tempfile.mkdtemp(prefix='codehive-exec-', dir=settings.EXECUTION_LOCAL_ROOT or None)
+        try:
+            with tracing.span('local.extract'):
+                self._extract(archive, workdir)
+            with tracing.span('local.exec'):
+                return self._run_process(workdir, command, output)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _extract(self, archive, workdir):
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(workdir, filter='data')
+        os.makedirs(os.path.join(workdir, '.tmp'), exist_ok=True)
+
+    def _limits(self):
+        timeout = settings.CODE_EXECUTION_TIMEOUT
+        return [
+            str(timeout + 1),
+            str(parse_size(settings.EXECUTION_MEMORY_LIMIT)),
+            str(parse_size(settings.EXECUTION_LOCAL_MAX_FILE_SIZE)),
+            str(settings.EXECUTION_LOCAL_MAX_PROCESSES),
+        ]
+
+    def _environment(self, workdir):
+        # Start from a clean environment so server secrets do not leak in
+        return {
+            'PATH': os.environ.get('PATH', '/usr/local/bin:/usr/bin:/bin'),
+            'HOME': workdir,
+            'TMPDIR': os.path.join(workdir, '.tmp'),
+            'LANG': 'C.UTF-8',
+            'PYTHONDONTWRITEBYTECODE': '1',
+        }
+
+    def _run_process(self, workdir, command, output):
+        start = time.perf_counter()
+        maxrss_read, maxrss_write = os.pipe()
+        try:
+            process = subprocess.Popen(
+                [sys.executable, '-I', '-S', '-c', LIMITS_SCRIPT, *self._limits(), str(maxrss_write), command],
+                cwd=workdir,
+                env=self._environment(workdir),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=(maxrss_write,),
+                start_new_session=True
+            )
+        finally:
+            os.close(maxrss_write)
+
+        timed_out = threading.Event()
+
+        def stop(sig):
+            if sig == signal.SIGTERM:
+                timed_out.set()
+            self._kill_group(process.pid, sig)
+
+        timers = [
+            threading.Timer(settings.CODE_EXECUTION_TIMEOUT, stop, args=(signal.SIGTERM,)),
+            threading.Timer(settings.CODE_EXECUTION_TIMEOUT + KILL_GRACE_PERIOD, stop, args=(signal.SIGKILL,)),
+        ]
+        for timer in timers:
+            timer.daemon = True
+            timer.start()
+
+        try:
+            status, rusage = self._stream_until_exit(process, output)
+        finally:
+            for timer in timers:
+                timer.cancel()
+            # Nothing started by the command may outlive it
+            self._kill_group(process.pid, signal.SIGKILL)
+            maxrss = self._read_all(maxrss_read)
+
+        exit_code = os.waitstatus_to_exitcode(status)
+        if exit_code < 0:
+            # Report signals like a shell (and Docker) does
+            exit_code = 128 - exit_code
+        usage = ResourceUsage.from_rusage(time.perf_counter() - start, rusage)
+        # The wrapper's own ru_maxrss includes what it inherited from the server
+        usage.peak_memory_bytes = int(maxrss) * 1024 if maxrss.isdigit() else None
+        return RunResult(exit_code, timed_out.is_set(), usage)
+
+    def _read_all(self, fd):
+        chunks = []
+        try:
+            while True:
+                data = os.read(fd, 64)
+                if not data:
+                    return b''.join(chunks).decode('ascii', errors='ignore')
+                chunks.append(data)
+        finally:
+            os.close(fd)
+
+    def _stream_until_exit(self, process, output):
+        streams = {process.stdout.fileno(): 'stdout', process.stderr.fileno(): 'stderr'}
+        selector = selectors.DefaultSelector()
+        for fd in streams:
+            os.set_blocking(fd, False)
+            selector.register(fd, selectors.EVENT_READ)
+
+        exited = None
+        drain_deadline = None
+        try:
+            while streams and (drain_deadline is None or time.monotonic() < drain_deadline):
+                for key, _ in selector.select(timeout=0.1):
+                    data = os.read(key.fd, 65536)
+                    if data:
+                        output.write(streams[key.fd], data)
+                    else:
+                        selector.unregister(key.fd)
+                        del streams[key.fd]
+
+                if exited is None:
+                    pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                    if pid:
+                        exited = (status, rusage)
+                        # Background children may still hold the pipes open
+                        self._kill_group(process.pid, signal.SIGKILL)
+                        drain_deadline = time.monotonic() + DRAIN_PERIOD
+
+            if exited is None:
+                _, status, rusage = os.wait4(process.pid, 0)
+                exited = (status, rusage)
+        finally:
+            selector.close()
+            process.stdout.close()
+            process.stderr.close()
+
+        # Reaped with wait4 to get its rusage, so tell Popen it is done
+        process.returncode = os.waitstatus_to_exitcode(exited[0])
+        return exited
+
+    def _kill_group(self, pid, sig):
+        try:
+            os.killpg(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+BACKENDS = {
+    DockerBackend.name: DockerBackend,
+    LocalSubprocessBackend.name: LocalSubprocessBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(project_id=None):
+    """
+    Backend for a project's executions: the local backend for projects in
+    EXECUTION_LOCAL_PROJECTS, EXECUTION_BACKEND otherwise
+    """
+    name = settings.EXECUTION_BACKEND
+    if project_id is not None and str(project_id) in settings.EXECUTION_LOCAL_PROJECTS:
+        name = LocalSubprocessBackend.name
+    if name not in BACKENDS:
+        raise ImproperlyConfigured(f"Unknown EXECUTION_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.setdefault(name, BACKENDS[name]())
+    return backend
\ No newline at end of file
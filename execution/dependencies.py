@@ -0,0 +1,237 @@
+"""
+Derived execution images with a project's dependencies preinstalled.
+
+When a project has a requirements.txt at its root, executions run in an
+image derived from EXECUTION_IMAGE with those requirements pip-installed.
+The requirements are user input, so the install runs in a container with
+the same memory, CPU and process limits as executions, on the
+EXECUTION_DEPS_NETWORK network, and is killed after
+EXECUTION_DEPS_BUILD_TIMEOUT seconds; the container is then committed as
+the image. Only wheels are installed, so no setup.py or build backend code
+runs; packages published only as source distributions are not supported.
+The image is tagged with a hash of the base image and the file's content, so
+projects with identical requirements share it and it is only rebuilt when
+the file changes. Each use touches a marker file; images unused for
+EXECUTION_DEPS_IMAGE_TTL seconds, or beyond the EXECUTION_DEPS_MAX_IMAGES
+most recently used, are removed by a periodic collection.
+"""
+
+import fcntl
+import hashlib
+import io
+import logging
+import os
+import tarfile
+import threading
+import time
+import docker
+import requests
+from django.conf import settings
+from .pool import discard_container_pool, get_docker_client
+from .workspace import ProjectWorkspace
+
+logger = logging.getLogger(__name__)
+
+REQUIREMENTS_PATH = 'requirements.txt'
+IMAGE_LABEL = 'codehive.deps'
+
+REQUIREMENTS_DIR = '/tmp/codehive-deps'
+# Seconds between SIGTERM and SIGKILL once an install runs out of time
+KILL_GRACE_PERIOD = 5
+
+
+def has_requirements(data):
+    """Whether a requirements file lists anything besides comments"""
+    for line in data.decode('utf-8', errors='replace').splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            return True
+    return False
+
+
+class DependencyImages:
+    def __init__(self, client, base_image, repository, marker_root, ttl, max_images, build_timeout, gc_interval,
+                 network, mem_limit, nano_cpus, pids_limit):
+        self.client = client
+        self.base_image = base_image
+        self.repository = repository
+        self.marker_root = marker_root
+        self.ttl = ttl
+        self.max_images = max_images
+        self.build_timeout = build_timeout
+        self.gc_interval = gc_interval
+        self.network = network
+        self.mem_limit = mem_limit
+        self.nano_cpus = nano_cpus
+        self.pids_limit = pids_limit
+        self._last_collected = time.monotonic()
+        self._collecting = False
+        self._lock = threading.Lock()
+
+    def image_for_project(self, project_id):
+        """
+        Image to run a project's executions in. Call after the project's
+        workspace has been synced
+        """
+        requirements = ProjectWorkspace(project_id).read_file(REQUIREMENTS_PATH)
+        if requirements is None or not has_requirements(requirements):
+            return self.base_image
+        return self.image_for(requirements)
+
+    def image_for(self, requirements):
+        """Tag of the image with ``requirements`` installed, building it if needed"""
+        key = hashlib.sha256(self.base_image.encode('utf-8') + b'\0' + requirements).hexdigest()
+        tag = f'{self.repository}:{key[:32]}'
+
+        # Mark the image as used first so a concurrent collection keeps it
+        os.makedirs(self.marker_root, exist_ok=True)
+        marker = os.path.join(self.marker_root, key)
+        with open(marker, 'a'):
+            os.utime(marker)
+
+        # Only one build per requirements hash, across threads and processes
+        with open(f'{marker}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if not self._exists(tag):
+                    self._build(tag, key, requirements)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self._maybe_collect()
+        return tag
+
+    def _exists(self, tag):
+        try:
+            self.client.images.get(tag)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+
+    def _build(self, tag, key, requirements):
+        context = io.BytesIO()
+        with tarfile.open(fileobj=context, mode='w') as tar:
+            info = tarfile.TarInfo(name=f'{REQUIREMENTS_DIR}/{REQUIREMENTS_PATH}'.lstrip('/'))
+            info.size = len(requirements)
+            tar.addfile(info, io.BytesIO(requirements))
+
+        command = [
+            'timeout', '-k', str(KILL_GRACE_PERIOD), str(self.build_timeout),
+            'pip', 'install', '--no-cache-dir', '--disable-pip-version-check', '--only-binary=:all:',
+            '-r', f'{REQUIREMENTS_DIR}/{REQUIREMENTS_PATH}'
+        ]
+        start = time.perf_counter()
+        container = self.client.containers.create(
+            self.base_image,
+            command=command,
+            network_mode=self.network,
+            mem_limit=self.mem_limit,
+            memswap_limit=self.mem_limit,
+            nano_cpus=self.nano_cpus,
+            pids_limit=self.pids_limit,
+            labels={IMAGE_LABEL + '.build': key}
+        )
+        try:
+            container.put_archive('/', context.getvalue())
+            container.start()
+            try:
+                exit_code = container.wait(timeout=self.build_timeout + KILL_GRACE_PERIOD + 30)['StatusCode']
+            except requests.exceptions.RequestException as e:
+                raise RuntimeError(f"Installing requirements.txt timed out after {self.build_timeout} seconds") from e
+            if exit_code != 0:
+                output = container.logs().decode('utf-8', errors='replace')
+                if exit_code == 124:
+                    output += f'\nTimed out after {self.build_timeout} seconds'
+                elif exit_code == 137:
+                    output += '\nKilled: out of time or memory'
+                raise RuntimeError(f"Installing requirements.txt failed:\n{output[-2000:]}")
+
+            base_config = self.client.images.get(self.base_image).attrs['Config']
+            container.commit(
+                repository=self.repository,
+                tag=key[:32],
+                conf={
+                    'Cmd': base_config.get('Cmd'),
+                    'Labels': {IMAGE_LABEL: key, 'codehive.base': self.base_image}
+                }
+            )
+        finally:
+            # Also stops an install still running after a timeout
+            try:
+                container.remove(force=True)
+            except docker.errors.APIError as e:
+                logger.warning(f"Could not remove dependency build container {container.id}: {e}")
+        logger.info(f"Built dependency image {tag} in {time.perf_counter() - start:.1f}s")
+
+    def _maybe_collect(self):
+        with self._lock:
+            if self._collecting or time.monotonic() - self._last_collected < self.gc_interval:
+                return
+            self._collecting = True
+        threading.Thread(target=self._collect, name='dependency-image-gc', daemon=True).start()
+
+    def _last_used(self, key):
+        try:
+            return os.path.getmtime(os.path.join(self.marker_root, key))
+        except FileNotFoundError:
+            return 0
+
+    def _collect(self):
+        try:
+            images = self.client.images.list(filters={'label': IMAGE_LABEL})
+            images.sort(key=lambda image: self._last_used(image.labels.get(IMAGE_LABEL, '')), reverse=True)
+            now = time.time()
+            for rank, image in enumerate(images):
+                key = image.labels.get(IMAGE_LABEL, '')
+                if rank < self.max_images and now - self._last_used(key) < self.ttl:
+                    continue
+                self._remove(image, key)
+        except Exception as e:
+            logger.warning(f"Could not collect dependency images: {e}")
+        finally:
+            with self._lock:
+                self._last_collected = time.monotonic()
+                self._collecting = False
+
+    def _remove(self, image, key):
+        for tag in image.tags:
+            discard_container_pool(tag)
+        try:
+            self.client.images.remove(image.id)
+        except docker.errors.APIError as e:
+            # Still used by a running container; try again next time
+            logger.info(f"Keeping dependency image {image.tags}: {e}")
+            return
+        for path in (os.path.join(self.marker_root, key), os.path.join(self.marker_root, f'{key}.lock')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Removed unused dependency image {image.tags}")
+
+
+_images = None
+_images_lock = threading.Lock()
+
+
+def get_dependency_images():
+    """Process-wide dependency image cache"""
+    global _images
+    if _images is None:
+        with _images_lock:
+            if _images is None:
+                _images = DependencyImages(
+                    client=get_docker_client(),
+                    base_image=settings.EXECUTION_IMAGE,
+                    repository=settings.EXECUTION_DEPS_REPOSITORY,
+                    marker_root=os.path.join(settings.EXECUTION_WORKSPACE_ROOT, '.deps'),
+                    ttl=settings.EXECUTION_DEPS_IMAGE_TTL,
+                    max_images=settings.EXECUTION_DEPS_MAX_IMAGES,
+                    build_timeout=settings.EXECUTION_DEPS_BUILD_TIMEOUT,
+                    gc_interval=settings.EXECUTION_DEPS_GC_INTERVAL,
+                    network=settings.EXECUTION_DEPS_NETWORK,
+                    mem_limit=settings.EXECUTION_MEMORY_LIMIT,
+                    nano_cpus=int(settings.EXECUTION_CPU_LIMIT * 1e9),
+                    pids_limit=settings.EXECUTION_PIDS_LIMIT
+                )
+    return _images
\ No newline at end of file
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from execution.models import ExecutionLogChunk, ExecutionResult
+
+
+class Command(BaseCommand):
+    help = ('Add the columns and indexes ExecutionResult gained for caching, queueing, '
+            'resource usage and output tails, and create the log chunk table, if they are missing')
+
+    def handle(self, *args, **options):
+        self.add_missing_columns(ExecutionResult)
+        self.add_missing_indexes(ExecutionResult)
+        self.create_missing_table(ExecutionLogChunk)
+        self.stdout.write(self.style.SUCCESS('Execution tables are up to date'))
+
+    def add_missing_columns(self, model):
+        table = model._meta.db_table
+        for field in model._meta.local_concrete_fields:
+            # Read again each time: SQLite adds some columns by rebuilding
+            # the table from the model, which adds the others too
+            if field.column in self.columns(table):
+                continue
+            self.stdout.write(f'Adding {table}.{field.column}')
+            with connection.schema_editor() as editor:
+                editor.add_field(model, field)
+
+    def columns(self, table):
+        with connection.cursor() as cursor:
+            return {column.name for column in connection.introspection.get_table_description(cursor, table)}
+
+    def add_missing_indexes(self, model):
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            indexed = [
+                constraint['columns'] for constraint in
+                connection.introspection.get_constraints(cursor, table).values()
+                if constraint['index']
+            ]
+        with connection.schema_editor() as editor:
+            for index in model._meta.indexes:
+                columns = [model._meta.get_field(name).column for name in index.fields]
+                if columns not in indexed:
+                    self.stdout.write(f'Adding index {index.name} on {table}')
+                    editor.add_index(model, index)
+
+    def create_missing_table(self, model):
+        if model._meta.db_table in connection.introspection.table_names():
+            return
+        self.stdout.write(f'Creating {model._meta.db_table}')
+        with connection.schema_editor() as editor:
+            editor.create_model(model)
\ No newline at end of file
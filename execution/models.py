@@ -16,14 +16,57 @@ class ExecutionResult(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='executions')
     command = models.TextField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Only the tail of each stream; the full output is in ExecutionLogChunk
     stdout = models.TextField(blank=True)
     stderr = models.TextField(blank=True)
+    stdout_size = models.PositiveBigIntegerField(default=0)
+    stderr_size = models.PositiveBigIntegerField(default=0)
+    output_truncated = models.BooleanField(default=False)
     exit_code = models.IntegerField(null=True)
+    # 1-based place in the execution queue while pending
+    queue_position = models.PositiveIntegerField(null=True, blank=True)
+    # Hash of the project's files the command ran against
+    snapshot_hash = models.CharField(max_length=64, blank=True)
+    cacheable = models.BooleanField(default=False)
+    cached_from = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='cache_hits')
+    # Resource usage of the run, sampled from docker stats
+    wall_time_ms = models.PositiveIntegerField(null=True, blank=True)
+    cpu_time_ms = models.PositiveBigIntegerField(null=True, blank=True)
+    peak_memory_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    block_read_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    block_write_bytes = models.PositiveBigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['project', 'snapshot_hash']),
+        ]
     
     def __str__(self):
-        return f"Execution {self.id} - {self.status}"
\ No newline at end of file
+        return f"Execution {self.id} - {self.status}"
+
+class ExecutionLogChunk(models.Model):
+    STREAM_CHOICES = [
+        ('stdout', 'Standard output'),
+        ('stderr', 'Standard error'),
+    ]
+    
+    execution = models.ForeignKey(ExecutionResult, on_delete=models.CASCADE, related_name='log_chunks')
+    stream = models.CharField(max_length=6, choices=STREAM_CHOICES)
+    index = models.PositiveIntegerField()
+    # Position of the chunk in the uncompressed UTF-8 stream
+    offset = models.PositiveBigIntegerField()
+    size = models.PositiveIntegerField()
+    line_offset = models.PositiveBigIntegerField()
+    line_count = models.PositiveIntegerField()
+    # zlib-compressed UTF-8 text
+    data = models.BinaryField()
+    
+    class Meta:
+        ordering = ['execution', 'stream', 'index']
+        unique_together = ('execution', 'stream', 'index')
+    
+    def __str__(self):
+        return f"Execution {self.execution_id} {self.stream} chunk {self.index}"
\ No newline at end of file
@@ -0,0 +1,201 @@
+"""
+Pool of pre-started, resource-limited containers for code execution.
+
+Each pooled container idles on ``sleep`` until it is leased. An execution
+copies the project into /app and runs the command with ``docker exec``. The
+pool is shared by every user and project, and a run can write anywhere in
+the container (site-packages, /etc, shell profiles), so a container serves a
+single execution and is removed afterwards; the pool only takes the
+container start off the request path. Containers are started with
+auto_remove, so their ``sleep`` expiring also cleans up after a crashed
+process.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WORKDIR = '/app'
+
+
+class PooledContainer:
+    def __init__(self, container):
+        self.container = container
+        self.started_at = time.monotonic()
+
+    def age(self):
+        return time.monotonic() - self.started_at
+
+
+class ContainerPool:
+    def __init__(self, client, image, size, max_age, mem_limit, nano_cpus, pids_limit):
+        self.client = client
+        self.image = image
+        self.size = size
+        self.max_age = max_age
+        self.mem_limit = mem_limit
+        self.nano_cpus = nano_cpus
+        self.pids_limit = pids_limit
+        self.pool_id = uuid.uuid4().hex[:12]
+        self._idle = []
+        self._lock = threading.Lock()
+        self._replenishing = False
+        self._closed = False
+
+    @contextmanager
+    def lease(self):
+        """Lease a container for one execution"""
+        pooled = self._acquire()
+        try:
+            yield pooled
+        finally:
+            # Never reused: the run may have changed anything in it
+            self._discard(pooled)
+            self.warm()
+
+    def warm(self):
+        """Start containers in the background until ``size`` are idle"""
+        with self._lock:
+            if self._closed or self._replenishing or len(self._idle) >= self.size:
+                return
+            self._replenishing = True
+        threading.Thread(target=self._replenish, name='container-pool-warmer', daemon=True).start()
+
+    def _replenish(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._closed or len(self._idle) >= self.size:
+                        return
+                pooled = self._start_container()
+                with self._lock:
+                    if self._closed:
+                        break
+                    self._idle.append(pooled)
+            self._discard(pooled)
+        except Exception as e:
+            logger.warning(f"Could not warm container pool: {e}")
+        finally:
+            with self._lock:
+                self._replenishing = False
+
+    def _is_fresh(self, pooled):
+        # Leave a margin so a container never expires in the middle of a run
+        return pooled.age() < self.max_age - settings.CODE_EXECUTION_TIMEOUT - 60
+
+    def _acquire(self):
+        pooled = None
+        stale = []
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if self._is_fresh(candidate):
+                    pooled = candidate
+                    break
+                stale.append(candidate)
+
+        for candidate in stale:
+            self._discard(candidate)
+
+        if pooled is None:
+            # Pool exhausted: pay the cold start for this run only
+            pooled = self._start_container()
+
+        return pooled
+
+    def _start_container(self):
+        container = self.client.containers.run(
+            self.image,
+            command=['sleep', str(self.max_age)],
+            working_dir=WORKDIR,
+            detach=True,
+            auto_remove=True,
+            name=f"codehive-pool-{self.pool_id}-{uuid.uuid4().hex[:8]}",
+            labels={'codehive.pool': self.pool_id},
+            mem_limit=self.mem_limit,
+            memswap_limit=self.mem_limit,
+            nano_cpus=self.nano_cpus,
+            pids_limit=self.pids_limit
+        )
+        return PooledContainer(container)
+
+    def _discard(self, pooled):
+        try:
+            pooled.container.kill()
+        except Exception:
+            # Already gone; auto_remove cleans up the rest
+            pass
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._discard(pooled)
+
+
+_client = None
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_docker_client():
+    """Process-wide Docker client"""
+    global _client
+    if _client is None:
+        with _pools_lock:
+            if _client is None:
+                import docker
+
+                _client = docker.DockerClient(base_url=settings.DOCKER_BASE_URL)
+    return _client
+
+
+def get_container_pool(image=None):
+    """
+    Process-wide container pool for an image (EXECUTION_IMAGE by default),
+    created and warmed on first use. Pools of derived dependency images keep
+    EXECUTION_DEPS_POOL_SIZE idle containers instead of EXECUTION_POOL_SIZE
+    """
+    image = image or settings.EXECUTION_IMAGE
+    pool = _pools.get(image)
+    if pool is None:
+        client = get_docker_client()
+        with _pools_lock:
+            pool = _pools.get(image)
+            if pool is None:
+                if not _pools:
+                    import atexit
+                    atexit.register(shutdown_container_pools)
+                pool = _pools[image] = ContainerPool(
+                    client=client,
+                    image=image,
+                    size=settings.EXECUTION_POOL_SIZE if image == settings.EXECUTION_IMAGE else settings.EXECUTION_DEPS_POOL_SIZE,
+                    max_age=settings.EXECUTION_POOL_MAX_AGE,
+                    mem_limit=settings.EXECUTION_MEMORY_LIMIT,
+                    nano_cpus=int(settings.EXECUTION_CPU_LIMIT * 1e9),
+                    pids_limit=settings.EXECUTION_PIDS_LIMIT
+                )
+                pool.warm()
+    return pool
+
+
+def discard_container_pool(image):
+    """Stop an image's pool and its idle containers, e.g. before removing the image"""
+    with _pools_lock:
+        pool = _pools.pop(image, None)
+    if pool is not None:
+        pool.shutdown()
+
+
+def shutdown_container_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
\ No newline at end of file
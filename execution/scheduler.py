@@ -0,0 +1,163 @@
+"""
+Fair scheduling of queued executions.
+
+At most EXECUTION_MAX_CONCURRENT executions run at once, with no more than
+EXECUTION_MAX_PER_USER for one user and EXECUTION_MAX_PER_PROJECT for one
+project. Waiting runs are ordered by weighted fair queuing: each user is a
+flow, and a run's virtual finish tag is its flow's previous tag (or the
+current virtual time, if later) plus 1 / weight. The runnable run with the
+smallest tag goes next, so a user who queues many runs cannot starve others.
+
+The counts kept here only cover this process. When ``slots`` is given, a run
+must also take a shared slot (see slots.py), so the caps hold across every
+process; runs held back by a shared cap are tried again every
+``retry_interval`` seconds, as other processes do not tell this one when
+their runs end.
+"""
+
+import bisect
+import contextvars
+import itertools
+import logging
+import threading
+from django.db import close_old_connections
+from .slots import CAPPED, FULL
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedRun:
+    def __init__(self, execution_id, user_id, project_id, start_tag, finish_tag, seq):
+        self.execution_id = execution_id
+        self.user_id = user_id
+        self.project_id = project_id
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.context = contextvars.copy_context()
+
+    def sort_key(self):
+        return (self.finish_tag, self.seq)
+
+
+class ExecutionScheduler:
+    def __init__(self, executor, run, capacity, max_per_user, max_per_project, on_queue_change=None,
+                 slots=None, retry_interval=1.0):
+        self.executor = executor
+        self.run = run
+        self.capacity = capacity
+        self.max_per_user = max_per_user
+        self.max_per_project = max_per_project
+        self.on_queue_change = on_queue_change
+        self.slots = slots
+        self.retry_interval = retry_interval
+        self._retry = None
+        self._waiting = []
+        self._keys = []
+        self._running_by_user = {}
+        self._running_by_project = {}
+        self._running = 0
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._positions = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, execution_id, user_id, project_id, weight=1.0):
+        """Queue an execution; it runs once capacity and its caps allow"""
+        with self._lock:
+            start_tag = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+            finish_tag = start_tag + 1.0 / weight
+            self._last_finish[user_id] = finish_tag
+            queued = QueuedRun(execution_id, user_id, project_id, start_tag, finish_tag, next(self._seq))
+            index = bisect.bisect(self._keys, queued.sort_key())
+            self._keys.insert(index, queued.sort_key())
+            self._waiting.insert(index, queued)
+        self._dispatch()
+
+    def queue_position(self, execution_id):
+        """1-based position among waiting runs, or None once it has started"""
+        with self._lock:
+            return self._positions.get(execution_id)
+
+    def stats(self):
+        with self._lock:
+            return {'running': self._running, 'waiting': len(self._waiting)}
+
+    def _runnable(self, queued):
+        return (self._running_by_user.get(queued.user_id, 0) < self.max_per_user and
+                self._running_by_project.get(queued.project_id, 0) < self.max_per_project)
+
+    def _dispatch(self):
+        started = []
+        blocked = False
+        with self._lock:
+            index = 0
+            while self._running < self.capacity and index < len(self._waiting):
+                queued = self._waiting[index]
+                if not self._runnable(queued):
+                    index += 1
+                    continue
+                if self.slots is not None:
+                    granted = self.slots.acquire(queued.execution_id, queued.user_id, queued.project_id)
+                    if granted == FULL:
+                        blocked = True
+                        break
+                    if granted == CAPPED:
+                        blocked = True
+                        index += 1
+                        continue
+                del self._waiting[index]
+                del self._keys[index]
+                self._virtual_time = max(self._virtual_time, queued.start_tag)
+                self._running += 1
+                self._running_by_user[queued.user_id] = self._running_by_user.get(queued.user_id, 0) + 1
+                self._running_by_project[queued.project_id] = self._running_by_project.get(queued.project_id, 0) + 1
+                started.append(queued)
+
+            positions = {queued.execution_id: position for position, queued in enumerate(self._waiting, start=1)}
+            changed = {
+                execution_id: position for execution_id, position in positions.items()
+                if self._positions.get(execution_id) != position
+            }
+            self._positions = positions
+            if not self._waiting and not self._running:
+                # Idle: forget old tags so virtual time does not grow forever
+                self._virtual_time = 0.0
+                self._last_finish.clear()
+            if blocked and self._retry is None:
+                self._retry = threading.Timer(self.retry_interval, self._retry_dispatch)
+                self._retry.daemon = True
+                self._retry.start()
+
+        for queued in started:
+            self.executor.submit(self._execute, queued)
+
+        if changed and self.on_queue_change:
+            try:
+                self.on_queue_change(changed)
+            except Exception:
+                logger.exception("Could not report queue positions")
+
+    def _retry_dispatch(self):
+        with self._lock:
+            self._retry = None
+        self._dispatch()
+
+    def _execute(self, queued):
+        try:
+            queued.context.run(self.run, queued.execution_id)
+        finally:
+            if self.slots is not None:
+                self.slots.release(queued.execution_id)
+            with self._lock:
+                self._running -= 1
+                self._decrement(self._running_by_user, queued.user_id)
+                self._decrement(self._running_by_project, queued.project_id)
+            self._dispatch()
+            close_old_connections()
+
+    def _decrement(self, counts, key):
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
\ No newline at end of file
@@ -4,7 +4,11 @@ from .models import ExecutionResult
 class ExecutionResultSerializer(serializers.ModelSerializer):
     class Meta:
         model = ExecutionResult
-        fields = ['id', 'project', 'user', 'command', 'status', 'stdout', 'stderr', 
-                  'exit_code', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'status', 'stdout', 'stderr', 'exit_code', 
-                           'created_at', 'updated_at']
\ No newline at end of file
+        fields = ['id', 'project', 'user', 'command', 'status', 'queue_position', 'stdout', 'stderr', 
+                  'stdout_size', 'stderr_size', 'output_truncated', 'exit_code', 'snapshot_hash', 
+                  'cacheable', 'cached_from', 'wall_time_ms', 'cpu_time_ms', 'peak_memory_bytes', 
+                  'block_read_bytes', 'block_write_bytes', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'status', 'queue_position', 'stdout', 'stderr', 'stdout_size', 
+                           'stderr_size', 'output_truncated', 'exit_code', 'snapshot_hash', 
+                           'cacheable', 'cached_from', 'wall_time_ms', 'cpu_time_ms', 'peak_memory_bytes', 
+                           'block_read_bytes', 'block_write_bytes', 'created_at', 'updated_at']
\ No newline at end of file
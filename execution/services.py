@@ -1,125 +1,160 @@
-import docker
-import tempfile
-import os
-import shutil
-import uuid
+import logging
+import time
 from django.conf import settings
+from django.utils import timezone
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from codehive import metrics, tracing
 from .models import ExecutionResult
-from projects.models import Project, File
+from .backends import get_backend
+from .streaming import ExecutionOutput
+from .workspace import current_snapshot_hash, materialize_project
+from projects.models import Project
+
+logger = logging.getLogger(__name__)
 
 class CodeExecutionService:
-    def __init__(self):
-        self.client = docker.DockerClient(base_url=settings.DOCKER_BASE_URL)
+    def execute_code(self, project_id, user_id, command, cacheable=False, use_cache=True):
+        """
+        Execute code for a project in its execution backend and wait for the result
+        """
+        execution = self.create_execution(project_id, user_id, command, cacheable, use_cache)
+        if execution.status == 'pending':
+            execution = self.run_execution(execution.id)
+        return execution
     
-    def execute_code(self, project_id, user_id, command):
+    def create_execution(self, project_id, user_id, command, cacheable=False, use_cache=True):
         """
-        Execute code for a project in a Docker container
+        Record a pending execution and notify the project. Cacheable commands
+        are answered from an earlier run on the same project snapshot unless
+        use_cache is False
         """
         try:
-            # Create execution record
-            project = Project.objects.get(id=project_id)
+            with tracing.span('db.create_execution'):
+                execution = ExecutionResult.objects.create(
+                    project=Project.objects.get(id=project_id),
+                    user_id=user_id,
+                    command=command,
+                    status='pending',
+                    cacheable=cacheable
+                )
+        except Exception as e:
             execution = ExecutionResult.objects.create(
-                project=project,
+                project_id=project_id,
                 user_id=user_id,
                 command=command,
-                status='pending'
+                status='failed',
+                stderr=f'Execution setup failed: {str(e)}'
             )
-            
-            # Update status to running
-            execution.status = 'running'
-            execution.save()
-            
+        
+        if execution.status == 'pending' and cacheable and use_cache:
+            try:
+                self._complete_from_cache(execution)
+            except Exception:
+                # A failed lookup only costs a container run
+                logger.exception(f"Execution cache lookup failed for {execution.id}")
+        
+        # Notify via WebSocket
+        self._notify_execution_update(execution)
+        
+        return execution
+    
+    @tracing.traced('execute_code')
+    def run_execution(self, execution_id):
+        """
+        Run a pending execution to completion
+        """
+        # Claim the run; it may have been queued again after a restart and
+        # already be handled by another worker
+        claimed = ExecutionResult.objects.filter(id=execution_id, status='pending').update(
+            status='running', queue_position=None, updated_at=timezone.now()
+        )
+        execution = ExecutionResult.objects.select_related('project').get(id=execution_id)
+        if not claimed:
+            return execution
+        project = execution.project
+        command = execution.command
+        
+        try:
             # Notify via WebSocket
             self._notify_execution_update(execution)
             
-            # Create temporary directory for project files
-            temp_dir = tempfile.mkdtemp()
-            try:
-                # Write project files to temp directory
-                self._write_project_files(project, temp_dir)
-                
-                # Run code in Docker container
-                container_name = f"codehive-execution-{uuid.uuid4()}"
-                container = self.client.containers.run(
-                    "python:3.9-slim",  # Base image
-                    command=command,
-                    volumes={temp_dir: {'bind': '/app', 'mode': 'rw'}},
-                    working_dir='/app',
-                    detach=True,
-                    name=container_name,
-                    remove=True
-                )
-                
-                # Wait for container to finish with timeout
+            # Package project files from the workspace cache
+            with tracing.span('build_project_archive'):
+                execution.snapshot_hash, archive = materialize_project(project.id)
+            execution.save(update_fields=['snapshot_hash'])
+            
+            # Run code in the project's execution backend
+            backend = get_backend(project.id)
+            backend_start = time.perf_counter()
+            with ExecutionOutput(execution) as output:
                 try:
-                    exit_code = container.wait(timeout=settings.CODE_EXECUTION_TIMEOUT)['StatusCode']
-                    stdout = container.logs(stdout=True, stderr=False).decode('utf-8')
-                    stderr = container.logs(stdout=False, stderr=True).decode('utf-8')
+                    with tracing.span('execution.run', backend=backend.name):
+                        result = backend.run(project.id, archive, command, output)
                     
-                    # Update execution record
-                    execution.status = 'completed'
-                    execution.stdout = stdout
-                    execution.stderr = stderr
-                    execution.exit_code = exit_code
-                    execution.save()
+                    if result.timed_out:
+                        execution.status = 'failed'
+                        output.write_text('stderr', f'\nExecution failed: timed out after {settings.CODE_EXECUTION_TIMEOUT} seconds')
+                    else:
+                        execution.status = 'completed'
                     
-                except docker.errors.NotFound:
-                    # Container was removed before we could get logs
-                    execution.status = 'failed'
-                    execution.stderr = 'Execution failed: container was removed'
-                    execution.save()
+                    result.apply(execution)
                 
                 except Exception as e:
-                    # Handle timeout or other errors
-                    try:
-                        container.kill()
-                    except:
-                        pass
-                    
                     execution.status = 'failed'
-                    execution.stderr = f'Execution failed: {str(e)}'
-                    execution.save()
-            
-            finally:
-                # Clean up temp directory
-                shutil.rmtree(temp_dir, ignore_errors=True)
+                    output.write_text('stderr', f'\nExecution failed: {str(e)}')
             
-            # Notify via WebSocket
-            self._notify_execution_update(execution)
+            # Update execution record
+            output.apply(execution)
+            execution.save()
             
-            return execution
+            metrics.EXECUTION_DURATION.observe(
+                time.perf_counter() - backend_start,
+                backend=backend.name,
+                status=execution.status
+            )
         
         except Exception as e:
             # Handle any other exceptions
-            execution = ExecutionResult.objects.create(
-                project_id=project_id,
-                user_id=user_id,
-                command=command,
-                status='failed',
-                stderr=f'Execution setup failed: {str(e)}'
-            )
-            
-            # Notify via WebSocket
-            self._notify_execution_update(execution)
-            
-            return execution
+            execution.status = 'failed'
+            execution.stderr = f'Execution setup failed: {str(e)}'
+            execution.save()
+        
+        # Notify via WebSocket
+        self._notify_execution_update(execution)
+        
+        return execution
     
-    def _write_project_files(self, project, temp_dir):
+    def _complete_from_cache(self, execution):
         """
-        Write project files to a temporary directory
+        Copy the result of the latest completed run of the same command on
+        an identical snapshot of the project, if there is one
         """
-        files = File.objects.filter(project=project)
+        with tracing.span('execution.cache_lookup'):
+            # Only files changed since the last sync are read; the request
+            # never syncs the workspace
+            execution.snapshot_hash = current_snapshot_hash(execution.project_id)
+            previous = ExecutionResult.objects.filter(
+                project_id=execution.project_id,
+                snapshot_hash=execution.snapshot_hash,
+                command=execution.command,
+                status='completed'
+            ).exclude(id=execution.id).order_by('-created_at').first()
         
-        for file in files:
-            # Create directories if needed
-            file_path = os.path.join(temp_dir, file.path)
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            # Write file content
-            with open(file_path, 'w') as f:
-                f.write(file.content)
+        metrics.record_cache_lookup('execution_result', previous is not None)
+        if previous is None:
+            execution.save(update_fields=['snapshot_hash'])
+            return
+        
+        execution.status = 'completed'
+        execution.stdout = previous.stdout
+        execution.stderr = previous.stderr
+        execution.stdout_size = previous.stdout_size
+        execution.stderr_size = previous.stderr_size
+        execution.output_truncated = previous.output_truncated
+        execution.exit_code = previous.exit_code
+        execution.cached_from_id = previous.cached_from_id or previous.id
+        execution.save()
     
     def _notify_execution_update(self, execution):
         """
@@ -135,9 +170,13 @@ class CodeExecutionService:
                 'execution': {
                     'id': str(execution.id),
                     'status': execution.status,
+                    'queue_position': execution.queue_position,
                     'command': execution.command,
                     'stdout': execution.stdout,
                     'stderr': execution.stderr,
+                    'stdout_size': execution.stdout_size,
+                    'stderr_size': execution.stderr_size,
+                    'output_truncated': execution.output_truncated,
                     'exit_code': execution.exit_code,
                     'created_at': execution.created_at.isoformat(),
                     'updated_at': execution.updated_at.isoformat(),
@@ -0,0 +1,145 @@
+"""
+Execution concurrency caps shared by every server process, tracked in Redis.
+
+The scheduler enforces EXECUTION_MAX_CONCURRENT, EXECUTION_MAX_PER_USER and
+EXECUTION_MAX_PER_PROJECT within one process. So that the caps hold for the
+whole host, a run also takes a lease before it starts: its id is added to
+the sorted sets ``execution:slots``, ``execution:slots:user:<id>`` and
+``execution:slots:project:<id>``, scored with the time of its last refresh.
+A Lua script drops expired leases and checks all three caps in one atomic
+step. Leases are refreshed every EXECUTION_SLOT_TTL / 3 seconds while the
+run goes on and removed when it ends, so a crashed process frees its slots
+after EXECUTION_SLOT_TTL.
+
+If Redis cannot be reached the caps fall back to the per-process ones.
+"""
+
+import logging
+import threading
+import time
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis errors, plus connection failures raised before redis wraps them
+SlotError = (redis.RedisError, OSError)
+
+GLOBAL_KEY = 'execution:slots'
+
+# Results of ExecutionSlots.acquire: a slot was taken, the run's user or
+# project is at its cap, or the host is at its cap
+GRANTED, CAPPED, FULL = 1, 0, -1
+
+# KEYS: global, user and project sets
+# ARGV: execution id, now, expiry cutoff, global cap, user cap, project cap, key TTL
+ACQUIRE_SCRIPT = """
+for i = 1, 3 do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', ARGV[3])
+end
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+        return -1
+    end
+    if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[5])
+        or redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[6]) then
+        return 0
+    end
+end
+for i = 1, 3 do
+    redis.call('ZADD', KEYS[i], ARGV[2], ARGV[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[7])
+end
+return 1
+"""
+
+
+def _keys(user_id, project_id):
+    return [GLOBAL_KEY, f'{GLOBAL_KEY}:user:{user_id}', f'{GLOBAL_KEY}:project:{project_id}']
+
+
+class ExecutionSlots:
+    def __init__(self, client, capacity, max_per_user, max_per_project, ttl):
+        self.client = client
+        self.capacity = capacity
+        self.max_per_user = max_per_user
+        self.max_per_project = max_per_project
+        self.ttl = ttl
+        self._acquire = client.register_script(ACQUIRE_SCRIPT)
+        self._held = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._failing = False
+
+    def acquire(self, execution_id, user_id, project_id):
+        """Take a slot for a run; returns GRANTED, CAPPED or FULL"""
+        now = time.time()
+        keys = _keys(user_id, project_id)
+        try:
+            result = int(self._acquire(keys=keys, args=[
+                str(execution_id), now, now - self.ttl,
+                self.capacity, self.max_per_user, self.max_per_project, int(self.ttl) + 1
+            ]))
+        except SlotError as e:
+            self._report_failure(e)
+            return GRANTED
+        self._failing = False
+        if result == GRANTED:
+            with self._lock:
+                self._held[str(execution_id)] = keys
+                if self._refresher is None:
+                    self._refresher = threading.Thread(target=self._refresh, name='execution-slots', daemon=True)
+                    self._refresher.start()
+        return result
+
+    def release(self, execution_id):
+        with self._lock:
+            keys = self._held.pop(str(execution_id), None)
+        if keys is None:
+            return
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.zrem(key, str(execution_id))
+            pipeline.execute()
+        except SlotError as e:
+            # The lease expires on its own
+            logger.warning(f"Could not release execution slot {execution_id}: {e}")
+
+    def _refresh(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            with self._lock:
+                held = list(self._held.items())
+            if not held:
+                continue
+            now = time.time()
+            try:
+                pipeline = self.client.pipeline(transaction=False)
+                for execution_id, keys in held:
+                    for key in keys:
+                        pipeline.zadd(key, {execution_id: now}, xx=True)
+                        pipeline.expire(key, int(self.ttl) + 1)
+                pipeline.execute()
+            except SlotError as e:
+                logger.warning(f"Could not refresh execution slots: {e}")
+
+    def _report_failure(self, error):
+        # Once per outage rather than on every dispatch
+        if not self._failing:
+            logger.warning(f"Execution slots unavailable, using per-process caps only: {error}")
+        self._failing = True
+
+
+def get_execution_slots():
+    """Shared slots per settings, or None when EXECUTION_SLOTS_REDIS_URL is empty"""
+    if not settings.EXECUTION_SLOTS_REDIS_URL:
+        return None
+    return ExecutionSlots(
+        # The scheduler waits on Redis while holding its lock, so never for long
+        client=redis.Redis.from_url(settings.EXECUTION_SLOTS_REDIS_URL, socket_timeout=2, socket_connect_timeout=2),
+        capacity=settings.EXECUTION_MAX_CONCURRENT,
+        max_per_user=settings.EXECUTION_MAX_PER_USER,
+        max_per_project=settings.EXECUTION_MAX_PER_PROJECT,
+        ttl=settings.EXECUTION_SLOT_TTL
+    )
\ No newline at end of file
@@ -0,0 +1,249 @@
+"""
+Incremental handling of execution output while the container runs.
+
+Chunks are decoded as they arrive and pushed to the project's channel group
+as ``execution_output`` events every EXECUTION_OUTPUT_PUSH_INTERVAL seconds.
+Output is stored in batches as zlib-compressed ExecutionLogChunk rows; the
+ExecutionResult row itself only keeps the last EXECUTION_LOG_TAIL_CHARS
+characters of each stream. Each stream is capped at EXECUTION_LOG_MAX_BYTES,
+after which a truncation marker is written and further output is dropped.
+"""
+
+import codecs
+import threading
+import time
+import zlib
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from .models import ExecutionLogChunk, ExecutionResult
+
+STREAMS = ('stdout', 'stderr')
+
+
+class _StreamState:
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.unpushed = []
+        self.unsaved = []
+        self.accepted = 0
+        self.saved = 0
+        self.lines = 0
+        self.index = 0
+        self.tail = ''
+        self.truncated = False
+
+
+class ExecutionOutput:
+    def __init__(self, execution):
+        self.execution_id = execution.id
+        self.group_name = f'project_{execution.project_id}'
+        self.push_interval = settings.EXECUTION_OUTPUT_PUSH_INTERVAL
+        self.flush_interval = settings.EXECUTION_OUTPUT_FLUSH_INTERVAL
+        self.flush_bytes = settings.EXECUTION_OUTPUT_FLUSH_BYTES
+        self.max_bytes = settings.EXECUTION_LOG_MAX_BYTES
+        self.tail_chars = settings.EXECUTION_LOG_TAIL_CHARS
+
+        self._streams = {stream: _StreamState() for stream in STREAMS}
+        self._unsaved_bytes = 0
+        self._last_saved = time.monotonic()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._pusher = threading.Thread(target=self._push_periodically, name='execution-output', daemon=True)
+
+    def __enter__(self):
+        self._pusher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, stream, data):
+        """Add raw bytes read from the container"""
+        if data:
+            self.write_text(stream, self._streams[stream].decoder.decode(data))
+
+    def write_text(self, stream, text):
+        """Add already decoded output, such as a failure message"""
+        if not text:
+            return
+        state = self._streams[stream]
+        with self._lock:
+            if state.truncated:
+                return
+            encoded = text.encode('utf-8')
+            if state.accepted + len(encoded) > self.max_bytes:
+                kept = encoded[:self.max_bytes - state.accepted].decode('utf-8', errors='ignore')
+                text = kept + f'\n[output truncated after {self.max_bytes} bytes]\n'
+                encoded = text.encode('utf-8')
+                state.truncated = True
+            state.unpushed.append(text)
+            state.unsaved.append(text)
+            state.accepted += len(encoded)
+            state.tail = (state.tail + text)[-self.tail_chars:]
+            self._unsaved_bytes += len(encoded)
+            save_now = self._unsaved_bytes >= self.flush_bytes
+        if save_now:
+            self._save()
+
+    def close(self):
+        """Flush everything that is still buffered"""
+        self._stopped.set()
+        if self._pusher.is_alive():
+            self._pusher.join()
+        for stream, state in self._streams.items():
+            self.write_text(stream, state.decoder.decode(b'', final=True))
+        self._push()
+        self._save()
+
+    def apply(self, execution):
+        """Copy the output tails and sizes onto an ExecutionResult"""
+        with self._lock:
+            execution.stdout = self._streams['stdout'].tail
+            execution.stderr = self._streams['stderr'].tail
+            execution.stdout_size = self._streams['stdout'].accepted
+            execution.stderr_size = self._streams['stderr'].accepted
+            execution.output_truncated = any(state.truncated for state in self._streams.values())
+
+    def _push_periodically(self):
+        try:
+            while not self._stopped.wait(self.push_interval):
+                self._push()
+                if time.monotonic() - self._last_saved >= self.flush_interval:
+                    self._save()
+        finally:
+            close_old_connections()
+
+    def _take(self, attribute):
+        with self._lock:
+            taken = {}
+            for stream, state in self._streams.items():
+                parts = getattr(state, attribute)
+                if parts:
+                    taken[stream] = ''.join(parts)
+                    setattr(state, attribute, [])
+        return taken
+
+    def _push(self):
+        chunks = self._take('unpushed')
+        if not chunks:
+            return
+        channel_layer = get_channel_layer()
+        for stream, data in chunks.items():
+            async_to_sync(channel_layer.group_send)(
+                self.group_name,
+                {
+                    'type': 'execution_output',
+                    'output': {
+                        'execution_id': str(self.execution_id),
+                        'stream': stream,
+                        'data': data
+                    }
+                }
+            )
+
+    def _save(self):
+        with self._save_lock:
+            with self._lock:
+                self._unsaved_bytes = 0
+                self._last_saved = time.monotonic()
+            chunks = self._take('unsaved')
+            if not chunks:
+                return
+
+            rows = []
+            for stream, text in chunks.items():
+                state = self._streams[stream]
+                data = text.encode('utf-8')
+                line_count = text.count('\n')
+                rows.append(ExecutionLogChunk(
+                    execution_id=self.execution_id,
+                    stream=stream,
+                    index=state.index,
+                    offset=state.saved,
+                    size=len(data),
+                    line_offset=state.lines,
+                    line_count=line_count,
+                    data=zlib.compress(data)
+                ))
+                state.index += 1
+                state.saved += len(data)
+                state.lines += line_count
+            ExecutionLogChunk.objects.bulk_create(rows)
+
+            # Keep the row's tail current for clients polling mid-run
+            with self._lock:
+                tails = {stream: self._streams[stream].tail for stream in chunks}
+            ExecutionResult.objects.filter(id=self.execution_id).update(**tails)
+
+
+def _split_lines(text):
+    # Lines end at '\n' only, matching how line offsets are counted
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+def _log_chunks(execution, stream):
+    # Cached results share the chunks of the run they were copied from
+    return ExecutionLogChunk.objects.filter(
+        execution_id=execution.cached_from_id or execution.id,
+        stream=stream
+    ).order_by('index')
+
+
+def read_log(execution, stream, start=0, end=None):
+    """
+    Return bytes [start, end) of a stream, decoded, and the stream's size.
+    Executions without stored chunks fall back to the text on the row
+    """
+    chunks = _log_chunks(execution, stream)
+    if not chunks.exists():
+        data = getattr(execution, stream).encode('utf-8')
+        return data[start:end].decode('utf-8', errors='replace'), len(data)
+
+    size = getattr(execution, f'{stream}_size')
+    end = size if end is None else min(end, size)
+    if start >= end:
+        return '', size
+
+    selected = chunks.filter(offset__lt=end, offset__gt=start - F('size'))
+    data = b''
+    first_offset = None
+    for chunk in selected:
+        if first_offset is None:
+            first_offset = chunk.offset
+        data += zlib.decompress(bytes(chunk.data))
+    if first_offset is None:
+        return '', size
+    return data[start - first_offset:end - first_offset].decode('utf-8', errors='replace'), size
+
+
+def read_log_lines(execution, stream, start_line=0, end_line=None):
+    """Return lines [start_line, end_line) of a stream"""
+    chunks = _log_chunks(execution, stream)
+    if not chunks.exists():
+        lines = _split_lines(getattr(execution, stream))
+        return ''.join(lines[start_line:end_line])
+
+    # The chunk holding the newline that ends the line before start_line
+    # also holds the beginning of start_line, so it has to be included
+    selected = chunks.filter(line_offset__gte=start_line - F('line_count'))
+    if end_line is not None:
+        selected = selected.filter(line_offset__lt=end_line)
+
+    first_line = None
+    text = ''
+    for chunk in selected:
+        if first_line is None:
+            first_line = chunk.line_offset
+        text += zlib.decompress(bytes(chunk.data)).decode('utf-8', errors='replace')
+    if first_line is None:
+        return ''
+
+    lines = _split_lines(text)
+    stop = None if end_line is None else end_line - first_line
+    return ''.join(lines[start_line - first_line:stop])
\ No newline at end of file
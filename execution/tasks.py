@@ -0,0 +1,182 @@
+"""
+Background execution of queued code runs.
+
+Runs are queued on a process-local ExecutionScheduler that feeds a thread
+pool of EXECUTION_MAX_CONCURRENT threads, so HTTP workers return as soon as
+the pending ExecutionResult is recorded. Status changes keep flowing to
+clients through the execution_update event. Queue positions move together
+whenever a run starts, so they are sent as one execution_queue event per
+project, mapping execution ids to positions.
+
+The queue only lives in memory, so a restart or crash loses it. When
+EXECUTION_RECOVERY_ENABLED is set, every server process starts a recovery
+thread with the ASGI application. Every EXECUTION_RECOVERY_INTERVAL seconds
+it touches updated_at on the runs this process has queued or is running,
+marks 'running' rows nobody has touched for three intervals as failed, and
+queues untouched 'pending' rows again. Two processes may queue the same row;
+that is safe because a worker claims a run by moving it from 'pending' to
+'running' and skips runs another worker claimed.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, PositiveIntegerField, Value, When
+from django.utils import timezone
+from .scheduler import ExecutionScheduler
+from .slots import get_execution_slots
+
+logger = logging.getLogger(__name__)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# Runs queued or running in this process, kept fresh by the recovery thread
+_active = set()
+_active_lock = threading.Lock()
+_recovery_started = False
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ExecutionScheduler(
+                    executor=ThreadPoolExecutor(
+                        max_workers=settings.EXECUTION_MAX_CONCURRENT,
+                        thread_name_prefix='execution-worker'
+                    ),
+                    run=run_execution,
+                    capacity=settings.EXECUTION_MAX_CONCURRENT,
+                    max_per_user=settings.EXECUTION_MAX_PER_USER,
+                    max_per_project=settings.EXECUTION_MAX_PER_PROJECT,
+                    on_queue_change=report_queue_positions,
+                    slots=get_execution_slots(),
+                    retry_interval=settings.EXECUTION_SLOT_RETRY_INTERVAL
+                )
+    return _scheduler
+
+
+def run_execution(execution_id):
+    """Worker entry point: run one pending execution"""
+    from .services import CodeExecutionService
+
+    close_old_connections()
+    try:
+        CodeExecutionService().run_execution(execution_id)
+    except Exception:
+        logger.exception(f"Execution {execution_id} crashed")
+    finally:
+        with _active_lock:
+            _active.discard(execution_id)
+        close_old_connections()
+
+
+def report_queue_positions(positions):
+    """
+    Store and broadcast the queue position of pending executions, with one
+    UPDATE overall and one message per project
+    """
+    from .models import ExecutionResult
+
+    pending = ExecutionResult.objects.filter(id__in=list(positions), status='pending')
+    pending.update(queue_position=Case(
+        *[When(id=execution_id, then=Value(position)) for execution_id, position in positions.items()],
+        output_field=PositiveIntegerField()
+    ))
+
+    by_project = {}
+    for execution_id, project_id in pending.values_list('id', 'project_id'):
+        by_project.setdefault(project_id, {})[str(execution_id)] = positions[execution_id]
+    channel_layer = get_channel_layer()
+    for project_id, project_positions in by_project.items():
+        async_to_sync(channel_layer.group_send)(
+            f'project_{project_id}',
+            {
+                'type': 'execution_queue',
+                'positions': project_positions
+            }
+        )
+
+
+def enqueue_execution(execution):
+    """Queue a pending execution; the caller's trace context goes with it"""
+    _submit(execution.id, execution.user_id, execution.project_id)
+    execution.queue_position = get_scheduler().queue_position(execution.id)
+
+
+def _submit(execution_id, user_id, project_id):
+    with _active_lock:
+        _active.add(execution_id)
+    get_scheduler().submit(execution_id, user_id, project_id)
+
+
+def start_recovery():
+    """Start this process's recovery thread, once"""
+    global _recovery_started
+    with _active_lock:
+        if _recovery_started:
+            return
+        _recovery_started = True
+    threading.Thread(target=_recover_periodically, name='execution-recovery', daemon=True).start()
+
+
+def _recover_periodically():
+    while True:
+        try:
+            recover_executions()
+        except Exception:
+            logger.exception("Could not recover executions")
+        finally:
+            close_old_connections()
+        time.sleep(settings.EXECUTION_RECOVERY_INTERVAL)
+
+
+def recover_executions():
+    """
+    Mark this process's runs as alive, fail runs whose process is gone and
+    queue pending runs left by another process again
+    """
+    from .models import ExecutionResult
+    from .services import CodeExecutionService
+
+    now = timezone.now()
+    with _active_lock:
+        active = list(_active)
+    if active:
+        ExecutionResult.objects.filter(id__in=active, status__in=['pending', 'running']).update(updated_at=now)
+
+    cutoff = now - timedelta(seconds=3 * settings.EXECUTION_RECOVERY_INTERVAL)
+    stuck = list(
+        ExecutionResult.objects.filter(status='running', updated_at__lt=cutoff).values_list('id', flat=True)
+    )
+    if stuck:
+        ExecutionResult.objects.filter(id__in=stuck, status='running', updated_at__lt=cutoff).update(
+            status='failed',
+            stderr='Execution failed: the server restarted while it was running',
+            updated_at=now
+        )
+        service = CodeExecutionService()
+        for execution in ExecutionResult.objects.filter(id__in=stuck, status='failed'):
+            service._notify_execution_update(execution)
+        logger.warning(f"Marked {len(stuck)} interrupted executions as failed")
+
+    pending = list(
+        ExecutionResult.objects.filter(status='pending', updated_at__lt=cutoff)
+        .order_by('created_at')
+        .values_list('id', 'user_id', 'project_id')
+    )
+    if pending:
+        # Take them over before queueing so other processes leave them alone
+        ExecutionResult.objects.filter(id__in=[row[0] for row in pending], status='pending').update(updated_at=now)
+    for execution_id, user_id, project_id in pending:
+        _submit(execution_id, user_id, project_id)
+    if pending:
+        logger.info(f"Queued {len(pending)} pending executions again")
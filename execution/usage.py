@@ -0,0 +1,116 @@
+"""
+Resource usage of one execution.
+
+Docker runs are sampled from ``docker stats``. Pooled containers outlive a
+single run, so CPU and block I/O are reported as the difference between a
+sample taken before the command starts and one taken after it ends. Peak
+memory is the highest working set (usage minus inactive page cache) seen by
+the sampler, which polls every EXECUTION_STATS_INTERVAL seconds; spikes
+shorter than that can be missed. Local subprocess runs use the rusage the
+kernel reports for the child when it is reaped.
+"""
+
+import logging
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _cpu_ns(stats):
+    return stats.get('cpu_stats', {}).get('cpu_usage', {}).get('total_usage', 0)
+
+
+def _working_set(stats):
+    memory = stats.get('memory_stats') or {}
+    usage = memory.get('usage', 0)
+    details = memory.get('stats') or {}
+    # cgroup v1 reports total_inactive_file, v2 inactive_file
+    inactive = details.get('total_inactive_file', details.get('inactive_file', 0))
+    return max(usage - inactive, 0)
+
+
+def _block_io(stats):
+    read = write = 0
+    for entry in (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []:
+        op = entry.get('op', '').lower()
+        if op == 'read':
+            read += entry.get('value', 0)
+        elif op == 'write':
+            write += entry.get('value', 0)
+    return read, write
+
+
+class ResourceUsage:
+    def __init__(self, wall_time_ms=None, cpu_time_ms=None, peak_memory_bytes=None,
+                 block_read_bytes=None, block_write_bytes=None):
+        self.wall_time_ms = wall_time_ms
+        self.cpu_time_ms = cpu_time_ms
+        self.peak_memory_bytes = peak_memory_bytes
+        self.block_read_bytes = block_read_bytes
+        self.block_write_bytes = block_write_bytes
+
+    @classmethod
+    def from_rusage(cls, wall_time, rusage):
+        """Usage of a local child process, from the rusage returned by wait4"""
+        return cls(
+            wall_time_ms=int(wall_time * 1000),
+            cpu_time_ms=int((rusage.ru_utime + rusage.ru_stime) * 1000),
+            # Linux reports ru_maxrss in KiB and block I/O in 512-byte units
+            peak_memory_bytes=rusage.ru_maxrss * 1024,
+            block_read_bytes=rusage.ru_inblock * 512,
+            block_write_bytes=rusage.ru_oublock * 512
+        )
+
+    def apply(self, execution):
+        """Copy the measurements onto an ExecutionResult"""
+        execution.wall_time_ms = self.wall_time_ms
+        execution.cpu_time_ms = self.cpu_time_ms
+        execution.peak_memory_bytes = self.peak_memory_bytes
+        execution.block_read_bytes = self.block_read_bytes
+        execution.block_write_bytes = self.block_write_bytes
+
+
+class ResourceSampler(ResourceUsage):
+    def __init__(self, container, interval=None):
+        super().__init__()
+        self.container = container
+        self.interval = settings.EXECUTION_STATS_INTERVAL if interval is None else interval
+        self._baseline = None
+        self._peak = 0
+        self._started = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name='execution-stats', daemon=True)
+
+    def __enter__(self):
+        self._baseline = self._sample()
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time_ms = int((time.perf_counter() - self._started) * 1000)
+        self._stopped.set()
+        self._thread.join()
+        final = self._sample()
+        if self._baseline is not None and final is not None:
+            self.cpu_time_ms = max(_cpu_ns(final) - _cpu_ns(self._baseline), 0) // 1_000_000
+            read, write = _block_io(final)
+            base_read, base_write = _block_io(self._baseline)
+            self.block_read_bytes = max(read - base_read, 0)
+            self.block_write_bytes = max(write - base_write, 0)
+            self.peak_memory_bytes = self._peak
+
+    def _poll(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        try:
+            stats = self.container.client.api.stats(self.container.id, stream=False, one_shot=True)
+        except Exception as e:
+            logger.warning(f"Could not sample container stats: {e}")
+            return None
+        self._peak = max(self._peak, _working_set(stats))
+        return stats
\ No newline at end of file
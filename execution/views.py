@@ -1,10 +1,15 @@
 from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from django.db.models import Avg, Count, Max, Sum
 from .models import ExecutionResult
 from .serializers import ExecutionResultSerializer
 from .services import CodeExecutionService
+from .streaming import STREAMS, read_log, read_log_lines
+from .tasks import enqueue_execution
 from projects.models import Project
+from projects.permissions import get_project_role
 
 class ExecutionResultViewSet(viewsets.ModelViewSet):
     serializer_class = ExecutionResultSerializer
@@ -27,16 +32,127 @@ class ExecutionResultViewSet(viewsets.ModelViewSet):
             )
         
         # Check if user has access to the project
-        project = get_object_or_404(Project, id=project_id)
-        if project.owner != request.user and not project.collaborators.filter(id=request.user.id).exists():
+        if get_project_role(request.user, project_id, request) is None:
+            get_object_or_404(Project, id=project_id)
             return Response(
                 {'error': 'You do not have access to this project'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Execute code
+        # Cacheable commands reuse the output of an earlier run on identical
+        # files; no_cache forces a fresh run
+        cacheable = self._flag(request.data.get('cacheable'))
+        use_cache = not self._flag(request.data.get('no_cache'))
+        
+        # Record the execution and run it in the background
         service = CodeExecutionService()
-        execution = service.execute_code(project_id, request.user.id, command)
+        execution = service.create_execution(project_id, request.user.id, command, cacheable, use_cache)
+        if execution.status == 'pending':
+            enqueue_execution(execution)
         
         serializer = self.get_serializer(execution)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        if execution.cached_from_id:
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'])
+    def usage(self, request):
+        """
+        Aggregate resource usage of a project's executions
+        """
+        project_id = request.query_params.get('project_id')
+        if not project_id:
+            return Response(
+                {'error': 'project_id is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if get_project_role(request.user, project_id, request) is None:
+            get_object_or_404(Project, id=project_id)
+            return Response(
+                {'error': 'You do not have access to this project'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        # Only runs that actually used a container have measurements
+        usage = ExecutionResult.objects.filter(
+            project_id=project_id,
+            wall_time_ms__isnull=False
+        ).aggregate(
+            executions=Count('id'),
+            total_wall_time_ms=Sum('wall_time_ms'),
+            avg_wall_time_ms=Avg('wall_time_ms'),
+            max_wall_time_ms=Max('wall_time_ms'),
+            total_cpu_time_ms=Sum('cpu_time_ms'),
+            avg_cpu_time_ms=Avg('cpu_time_ms'),
+            avg_peak_memory_bytes=Avg('peak_memory_bytes'),
+            max_peak_memory_bytes=Max('peak_memory_bytes'),
+            total_block_read_bytes=Sum('block_read_bytes'),
+            total_block_write_bytes=Sum('block_write_bytes')
+        )
+        usage['project_id'] = str(project_id)
+        
+        return Response(usage)
+    
+    @action(detail=True, methods=['get'])
+    def logs(self, request, pk=None):
+        """
+        Fetch part of an execution's output, either bytes [start, end) or
+        lines [start_line, end_line)
+        """
+        execution = self.get_object()
+        stream = request.query_params.get('stream', 'stdout')
+        if stream not in STREAMS:
+            return Response(
+                {'error': f'stream must be one of {", ".join(STREAMS)}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            start = self._offset(request.query_params.get('start'), 0)
+            end = self._offset(request.query_params.get('end'), None)
+            start_line = self._offset(request.query_params.get('start_line'), None)
+            end_line = self._offset(request.query_params.get('end_line'), None)
+        except ValueError:
+            return Response(
+                {'error': 'Offsets must be non-negative integers'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        response = {
+            'execution_id': str(execution.id),
+            'stream': stream,
+            'size': getattr(execution, f'{stream}_size'),
+            'truncated': execution.output_truncated
+        }
+        
+        if start_line is not None or end_line is not None:
+            start_line = start_line or 0
+            response.update({
+                'start_line': start_line,
+                'end_line': end_line,
+                'data': read_log_lines(execution, stream, start_line, end_line)
+            })
+        else:
+            data, size = read_log(execution, stream, start, end)
+            response.update({
+                'start': start,
+                'end': min(end, size) if end is not None else size,
+                'size': size,
+                'data': data
+            })
+        
+        return Response(response)
+    
+    def _offset(self, value, default):
+        if value in (None, ''):
+            return default
+        value = int(value)
+        if value < 0:
+            raise ValueError(value)
+        return value
+    
+    def _flag(self, value):
+        if isinstance(value, str):
+            return value.lower() in ('1', 'true', 'yes', 'on')
+        return bool(value)
\ No newline at end of file
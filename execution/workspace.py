@@ -0,0 +1,217 @@
+"""
+Host-side cache of each project's files for code execution.
+
+Every project gets a directory under EXECUTION_WORKSPACE_ROOT holding a copy
+of its files, a manifest of (file id, updated_at, sha256) per path and the
+tar archive last shipped to a container. A run first reads only file
+metadata; content is loaded and written for the files that changed since the
+previous run, and the archive is rebuilt only when something changed.
+
+Paths are normalized (``/a.py`` and ``./a.py`` are ``a.py``). When several
+files normalize to the same path, the most recently updated one is used.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tarfile
+from contextlib import contextmanager
+from django.conf import settings
+from projects.models import File
+
+MANIFEST_NAME = 'manifest.json'
+ARCHIVE_NAME = 'archive.tar'
+FILES_DIR = 'files'
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectWorkspace:
+    def __init__(self, project_id, root=None):
+        self.project_id = str(project_id)
+        self.path = os.path.join(root or settings.EXECUTION_WORKSPACE_ROOT, self.project_id)
+        self.files_path = os.path.join(self.path, FILES_DIR)
+        self.manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        self.archive_path = os.path.join(self.path, ARCHIVE_NAME)
+
+    @contextmanager
+    def locked(self):
+        """Serialise syncs of this project across threads and processes"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def sync(self):
+        """
+        Bring the workspace up to date with the database and return the
+        manifest and the tar archive of the project's files
+        """
+        with self.locked():
+            manifest = self._load_manifest()
+            current = self.current_versions()
+
+            changed = {
+                version[0]: path for path, version in current.items()
+                if (manifest.get(path) or {}).get('version') != version
+            }
+            # Removed first, as a removed entry can share its copy with a
+            # changed one (manifests from before paths were normalized)
+            removed = [path for path in manifest if path not in current]
+            for path in removed:
+                self._remove(path)
+                del manifest[path]
+            updated = self._write_changed(manifest, changed)
+
+            if updated or removed or not os.path.exists(self.archive_path):
+                self._build_archive(manifest)
+            if changed or removed:
+                self._save_manifest(manifest)
+
+            with open(self.archive_path, 'rb') as archive:
+                return manifest, archive.read()
+
+    def current_versions(self):
+        """[file id, updated_at] of every file by normalized path, from the database"""
+        current = {}
+        for file_id, path, updated_at in File.objects.filter(project_id=self.project_id).order_by(
+            'updated_at', 'id'
+        ).values_list('id', 'path', 'updated_at'):
+            _, relative = self._local_path(path)
+            if relative in current:
+                logger.warning(f"Several files of project {self.project_id} map to {relative}; using the newest")
+            current[relative] = [str(file_id), updated_at.isoformat()]
+        return current
+
+    def current_digests(self):
+        """
+        sha256 of every file's content by normalized path. Digests of files
+        unchanged since the last sync come from the manifest, so only the
+        others are read from the database; the workspace is left as it is
+        """
+        manifest = self._load_manifest()
+        digests = {}
+        stale = {}
+        for path, version in self.current_versions().items():
+            entry = manifest.get(path)
+            if entry is not None and entry['version'] == version:
+                digests[path] = entry['sha256']
+            else:
+                stale[version[0]] = path
+        if stale:
+            for file in File.objects.filter(id__in=list(stale)).only('id', 'content'):
+                digests[stale[str(file.id)]] = hashlib.sha256(file.content.encode('utf-8')).hexdigest()
+        return digests
+
+    def read_file(self, path):
+        """Content of a file as of the last sync, or None if it is not there"""
+        local_path, _ = self._local_path(path)
+        try:
+            with open(local_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_changed(self, manifest, changed):
+        # ``changed`` maps file ids to their normalized paths. Returns True
+        # when the content of any file actually changed
+        updated = False
+        if not changed:
+            return updated
+        for file in File.objects.filter(id__in=list(changed)).only('id', 'content', 'updated_at'):
+            path = changed[str(file.id)]
+            data = file.content.encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()
+            entry = manifest.get(path)
+            if entry is None or entry['sha256'] != digest:
+                self._write(path, data)
+                updated = True
+            manifest[path] = {
+                'version': [str(file.id), file.updated_at.isoformat()],
+                'sha256': digest,
+                'mtime': int(file.updated_at.timestamp())
+            }
+        return updated
+
+    def _local_path(self, path):
+        relative = os.path.normpath(path.lstrip('/'))
+        if relative.startswith('..') or os.path.isabs(relative):
+            raise ValueError(f"File path escapes the project: {path}")
+        return os.path.join(self.files_path, relative), relative
+
+    def _write(self, path, data):
+        local_path, _ = self._local_path(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp_path = f'{local_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, local_path)
+
+    def _remove(self, path):
+        local_path, _ = self._local_path(path)
+        try:
+            os.remove(local_path)
+        except FileNotFoundError:
+            pass
+
+    def _build_archive(self, manifest):
+        tmp_path = f'{self.archive_path}.tmp'
+        with tarfile.open(tmp_path, mode='w') as tar:
+            for path in sorted(manifest):
+                local_path, relative = self._local_path(path)
+                info = tar.gettarinfo(local_path, arcname=relative)
+                info.mode = 0o644
+                info.mtime = manifest[path]['mtime']
+                info.uid = info.gid = 0
+                info.uname = info.gname = ''
+                with open(local_path, 'rb') as f:
+                    tar.addfile(info, f)
+        os.replace(tmp_path, self.archive_path)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        # Drop entries whose copy went missing so they are written again
+        return {
+            path: entry for path, entry in manifest.items()
+            if os.path.exists(self._local_path(path)[0])
+        }
+
+    def _save_manifest(self, manifest):
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def snapshot_hash(digests):
+    """
+    Deterministic hash of a project's files, from their paths and the
+    sha256 of their content
+    """
+    digest = hashlib.sha256()
+    for path in sorted(digests):
+        digest.update(f"{path}\0{digests[path]}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def current_snapshot_hash(project_id):
+    """Snapshot hash of a project's files as they are in the database"""
+    return snapshot_hash(ProjectWorkspace(project_id).current_digests())
+
+
+def materialize_project(project_id):
+    """
+    Return the snapshot hash and tar archive of a project's files, served
+    from its workspace cache
+    """
+    manifest, archive = ProjectWorkspace(project_id).sync()
+    return snapshot_hash({path: entry['sha256'] for path, entry in manifest.items()}), archive
\ No newline at end of file
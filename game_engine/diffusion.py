@@ -0,0 +1,52 @@
+"""
+Pixel art portrait rendering with SDXL + the LCM and pixel-art-xl LoRAs.
+torch and diffusers are imported lazily so the web app starts without them.
+"""
+
+NEGATIVE_PROMPT = "3d render, realistic, blurry, low quality, distorted, deformed"
+NUM_INFERENCE_STEPS = 8
+GUIDANCE_SCALE = 1.5
+
+
+def load_pipeline():
+    """Load the diffusion pipeline onto the GPU when one is available"""
+    from diffusers import DiffusionPipeline, LCMScheduler
+    import torch
+
+    # Set device to use your RTX 4050
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+
+    # Load base SDXL model
+    model_id = "stabilityai/stable-diffusion-xl-base-1.0"
+    pipe = DiffusionPipeline.from_pretrained(
+        model_id,
+        variant="fp16",  # Load fp16 for VRAM savings
+        torch_dtype=torch.float16
+    )
+
+    # Replace the scheduler with the LCM scheduler
+    pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config)
+
+    # Load LoRA weights
+    # First: LCM LoRA adapter (for fast inference)
+    pipe.load_lora_weights("latent-consistency/lcm-lora-sdxl", adapter_name="lora")
+    # Second: Pixel Art XL LoRA adapter
+    pipe.load_lora_weights("nerijs/pixel-art-xl", adapter_name="pixel")
+
+    # Set both adapters to use with specified weights
+    pipe.set_adapters(["lora", "pixel"], adapter_weights=[1.0, 1.2])
+
+    # Move pipeline to GPU
+    pipe.to(device)
+    return pipe
+
+
+def render_images(pipe, prompts):
+    """Render one image per prompt in a single batched pipeline call"""
+    return pipe(
+        prompt=list(prompts),
+        negative_prompt=[NEGATIVE_PROMPT] * len(prompts),
+        num_inference_steps=NUM_INFERENCE_STEPS,
+        guidance_scale=GUIDANCE_SCALE,
+    ).images
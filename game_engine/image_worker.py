@@ -0,0 +1,124 @@
+"""
+Background worker that renders portraits in batches.
+
+Jobs submitted within IMAGE_BATCH_WINDOW_MS of the first queued job (up to
+IMAGE_BATCH_MAX_SIZE of them) are rendered with a single pipeline call and
+the images are handed back to each caller through its future.
+"""
+
+import io
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import close_old_connections
+from codehive import metrics, tracing
+from . import diffusion
+
+logger = logging.getLogger(__name__)
+
+
+class _RenderJob:
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.future = Future()
+
+
+class DiffusionBatcher:
+    def __init__(self, window_ms, max_batch_size, load_pipeline=diffusion.load_pipeline,
+                 render_images=diffusion.render_images):
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._load_pipeline = load_pipeline
+        self._render_images = render_images
+        self._pipe = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, prompt):
+        """Queue a prompt; the returned future resolves to PNG bytes"""
+        self._ensure_worker()
+        job = _RenderJob(prompt)
+        self._queue.put(job)
+        return job.future
+
+    def pending(self):
+        """Approximate number of jobs waiting for a batch"""
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='diffusion-batcher', daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            jobs = [job for job in batch if job.future.set_running_or_notify_cancel()]
+            if jobs:
+                self._render_batch(jobs)
+                # Done callbacks may have used the ORM from this thread
+                close_old_connections()
+
+    def _render_batch(self, jobs):
+        metrics.DIFFUSION_BATCH_SIZE.observe(len(jobs))
+        start = time.perf_counter()
+        try:
+            with tracing.span('diffusion.render_batch', batch_size=len(jobs)):
+                if self._pipe is None:
+                    self._pipe = self._load_pipeline()
+                images = self._render_images(self._pipe, [job.prompt for job in jobs])
+            if len(images) != len(jobs):
+                raise RuntimeError(f"Pipeline returned {len(images)} images for {len(jobs)} prompts")
+        except Exception as e:
+            logger.exception("Diffusion batch failed")
+            metrics.DIFFUSION_RENDER_DURATION.observe(time.perf_counter() - start, status='failed')
+            for job in jobs:
+                job.future.set_exception(e)
+            return
+
+        metrics.DIFFUSION_RENDER_DURATION.observe(time.perf_counter() - start, status='completed')
+        for job, image in zip(jobs, images):
+            try:
+                buffer = io.BytesIO()
+                image.save(buffer, format='PNG')
+            except Exception as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(buffer.getvalue())
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Process-wide batcher, created on first use"""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = DiffusionBatcher(
+                    window_ms=settings.IMAGE_BATCH_WINDOW_MS,
+                    max_batch_size=settings.IMAGE_BATCH_MAX_SIZE
+                )
+    return _batcher
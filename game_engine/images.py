@@ -0,0 +1,184 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image, ImageChops
+
+# <content hash>[-variant].<ext>
+IMAGE_FILENAME_PATTERN = re.compile(r'^[0-9a-f]{16}(-[a-z]+)?\.(png|webp)$')
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+
+def session_image_dir(session_id):
+    """Directory holding every image rendered for a game session"""
+    return os.path.join(settings.GAME_IMAGE_ROOT, str(session_id))
+
+
+def image_path(session_id, filename):
+    return os.path.join(session_image_dir(session_id), filename)
+
+
+def image_url(session_id, filename):
+    return reverse('game_engine:session_image', args=[str(session_id), filename])
+
+
+def _write_once(path, data):
+    """
+    Atomically write ``data`` to ``path`` unless it already exists.
+    Names are content hashes, so an existing file already has the right bytes.
+    """
+    if os.path.exists(path):
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _edge_profile(gray, axis):
+    """Mean absolute change between neighbouring columns (axis 0) or rows (axis 1)"""
+    if axis == 1:
+        gray = gray.transpose(Image.TRANSPOSE)
+    width, height = gray.size
+    diff = ImageChops.difference(gray.crop((1, 0, width, height)), gray.crop((0, 0, width - 1, height)))
+    return list(diff.resize((width - 1, 1), Image.BOX).getdata())
+
+
+def _phase_concentration(profile, block):
+    """
+    Share of all edge energy that falls on one pair of neighbouring phases
+    when the profile is folded every ``block`` pixels, and the block offset
+    that implies. Pairs are used because resampling smears edges over two
+    pixels.
+    """
+    phases = [sum(profile[phase::block]) for phase in range(block)]
+    total = sum(phases)
+    if not total:
+        return 0.0, 0
+    pair = max(range(block), key=lambda phase: phases[phase] + phases[(phase + 1) % block])
+    phase = pair if phases[pair] >= phases[(pair + 1) % block] else (pair + 1) % block
+    # A change at ``phase`` means a new block starts at phase + 1
+    return (phases[pair] + phases[(pair + 1) % block]) / total, (phase + 1) % block
+
+
+def detect_pixel_grid(image, max_block=64):
+    """
+    Detect the size and offset of the blocks making up a pixel-art image.
+    Returns (block, x_offset, y_offset), or None when no clear grid is found.
+    """
+    gray = image.convert('L')
+    profiles = [_edge_profile(gray, axis) for axis in (0, 1)]
+
+    shares = {}
+    for block in range(2, min(max_block, *image.size) + 1):
+        (share_x, offset_x), (share_y, offset_y) = (_phase_concentration(p, block) for p in profiles)
+        shares[block] = ((share_x + share_y) / 2, offset_x, offset_y)
+
+    # Divisors of the real block size concentrate the energy just as well and
+    # multiples only about half as well, so take the largest strong block size
+    best_share = max(share for share, _, _ in shares.values())
+    block = max(block for block, (share, _, _) in shares.items() if share >= best_share * 0.75)
+    share, offset_x, offset_y = shares[block]
+
+    # Without a grid a pair of phases gets about 2 / block of the energy
+    if share * block < 3:
+        return None
+    return block, offset_x, offset_y
+
+
+def to_native_pixel_art(image):
+    """
+    Downsample a rendered pixel-art image to one pixel per block with nearest
+    neighbour sampling and quantize it to an indexed palette.
+    """
+    image = image.convert('RGB')
+    grid = detect_pixel_grid(image)
+    if grid is None and settings.GAME_IMAGE_DEFAULT_PIXEL_SIZE > 1:
+        grid = (settings.GAME_IMAGE_DEFAULT_PIXEL_SIZE, 0, 0)
+
+    if grid is not None:
+        block, offset_x, offset_y = grid
+        columns = (image.width - offset_x) // block
+        rows = (image.height - offset_y) // block
+        image = image.resize(
+            (columns, rows),
+            Image.NEAREST,
+            box=(offset_x, offset_y, offset_x + columns * block, offset_y + rows * block)
+        )
+
+    return image.quantize(
+        colors=settings.GAME_IMAGE_PALETTE_SIZE,
+        method=Image.Quantize.MEDIANCUT,
+        dither=Image.Dither.NONE
+    )
+
+
+def _encode(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def store_session_image(session_id, png_bytes):
+    """
+    Store a rendered PNG for a session under its content hash and derive the
+    compact web variants next to it. Returns the URL of every variant.
+
+    The ``native`` variant is the portrait at one pixel per pixel-art block;
+    clients scale it up with ``image-rendering: pixelated``.
+    """
+    digest = hashlib.sha256(png_bytes).hexdigest()[:16]
+    os.makedirs(session_image_dir(session_id), exist_ok=True)
+
+    filenames = {
+        'native': f'{digest}-native.png',
+        'webp': f'{digest}.webp',
+        'thumbnail': f'{digest}-thumb.webp',
+    }
+    if settings.GAME_IMAGE_KEEP_ORIGINAL:
+        filenames['original'] = f'{digest}.png'
+        _write_once(image_path(session_id, filenames['original']), png_bytes)
+
+    # Variants are only generated the first time this content is stored
+    if not all(os.path.exists(image_path(session_id, name)) for name in filenames.values()):
+        with Image.open(io.BytesIO(png_bytes)) as image:
+            image = image.convert('RGB')
+            _write_once(
+                image_path(session_id, filenames['native']),
+                _encode(to_native_pixel_art(image), 'PNG', optimize=True)
+            )
+            _write_once(
+                image_path(session_id, filenames['webp']),
+                _encode(image, 'WEBP', quality=settings.GAME_IMAGE_WEBP_QUALITY, method=6)
+            )
+
+            thumbnail = image.copy()
+            size = settings.GAME_IMAGE_THUMBNAIL_SIZE
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+            _write_once(
+                image_path(session_id, filenames['thumbnail']),
+                _encode(thumbnail, 'WEBP', quality=settings.GAME_IMAGE_WEBP_QUALITY, method=6)
+            )
+
+    return {variant: image_url(session_id, name) for variant, name in filenames.items()}
+
+
+def store_native_image(session_id, png_bytes):
+    """Store an image that is already at native resolution, without variants"""
+    digest = hashlib.sha256(png_bytes).hexdigest()[:16]
+    os.makedirs(session_image_dir(session_id), exist_ok=True)
+    filename = f'{digest}-native.png'
+    _write_once(image_path(session_id, filename), png_bytes)
+    return {'native': image_url(session_id, filename)}
@@ -0,0 +1,80 @@
+"""
+Procedural pixel-art portraits shown while the real render is pending.
+
+The sprite is seeded from the image prompt, so the same character always
+gets the same placeholder, and tinted by the world genre. Rendering is pure
+Pillow on a 16x16 canvas and takes well under a millisecond.
+"""
+
+import hashlib
+import io
+import random
+from PIL import Image
+
+GENRE_TINTS = {
+    'Fantasy': (86, 160, 92),
+    'Sci-Fi': (70, 150, 220),
+    'Cyberpunk': (230, 60, 200),
+    'Post-Apocalyptic': (190, 140, 70),
+    'Steampunk': (180, 120, 60),
+    'Modern': (140, 140, 160),
+    'Horror': (150, 30, 40),
+}
+DEFAULT_TINT = (128, 128, 128)
+
+SPRITE_SIZE = 16
+
+
+def _mix(color, other, amount):
+    return tuple(round(a + (b - a) * amount) for a, b in zip(color, other))
+
+
+def _scale(color, factor):
+    return tuple(max(0, min(255, round(channel * factor))) for channel in color)
+
+
+def render_placeholder(prompt, genre, size=SPRITE_SIZE):
+    """Return a deterministic, horizontally symmetric sprite as an RGB image"""
+    rng = random.Random(hashlib.sha256(f'{genre}:{prompt}'.encode('utf-8')).digest())
+    tint = GENRE_TINTS.get(genre, DEFAULT_TINT)
+
+    body = _mix(tuple(rng.randint(40, 255) for _ in range(3)), tint, 0.5)
+    highlight = _scale(body, 1.35)
+    outline = _scale(body, 0.45)
+    background = _scale(tint, 0.25)
+
+    # Fill the left half at random, denser towards the middle, then mirror it
+    half = size // 2
+    filled = set()
+    for y in range(2, size - 1):
+        for x in range(1, half):
+            if rng.random() < 0.1 + 0.55 * x / half:
+                filled.add((x, y))
+                filled.add((size - 1 - x, y))
+
+    image = Image.new('RGB', (size, size), background)
+    pixels = image.load()
+    for x, y in sorted(filled):
+        pixels[x, y] = highlight if rng.random() < 0.2 else body
+
+    # Outline the silhouette so it reads at any scale
+    for y in range(size):
+        for x in range(size):
+            if (x, y) in filled:
+                continue
+            neighbours = ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1))
+            if any(neighbour in filled for neighbour in neighbours):
+                pixels[x, y] = outline
+
+    # Eyes
+    eye_y = size // 3
+    for x in (half - 2, size - 1 - (half - 2)):
+        pixels[x, eye_y] = (255, 255, 255)
+
+    return image
+
+
+def render_placeholder_png(prompt, genre):
+    buffer = io.BytesIO()
+    render_placeholder(prompt, genre).save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
@@ -8,4 +8,5 @@ urlpatterns = [
     path('api/game/new-session/', views.create_game_session, name='create_game_session'),
     path('api/game/scene/<str:session_id>/', views.get_game_scene, name='get_game_scene'),
     path('api/game/choice/<str:session_id>/', views.make_choice, name='make_choice'),
+    path('api/game/images/<str:session_id>/<str:filename>', views.session_image, name='session_image'),
 ] 
\ No newline at end of file
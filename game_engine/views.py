@@ -1,14 +1,21 @@
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, Http404
+from django.db import transaction
 import sys
 import os
+import functools
+import threading
 import json
 import uuid
 import re
+import time
 import traceback
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from django.conf import settings
+from codehive import metrics, tracing
 from .models import GameSession
+from . import images, image_worker, placeholders
 
 # Import the Google Generative AI library
 import google.generativeai as genai
@@ -18,6 +25,16 @@ API_KEY = os.environ.get('GEMINI_API_KEY', '')
 genai.configure(api_key=API_KEY)
 model = genai.GenerativeModel('gemini-2.0-flash')
 
+def _generate_content(prompt, operation):
+    """Call Gemini and record latency and error metrics for the call"""
+    with tracing.span('gemini.generate_content', operation=operation):
+        with metrics.GEMINI_REQUEST_DURATION.time(operation=operation):
+            try:
+                return model.generate_content(prompt)
+            except Exception:
+                metrics.GEMINI_REQUEST_ERRORS.inc(operation=operation)
+                raise
+
 def index(request):
     # Reset any previous game state
     if 'story_context' in request.session:
@@ -88,7 +105,7 @@ def game(request):
                 Keep it under 250 words.
                 """
                 
-                response = model.generate_content(prompt)
+                response = _generate_content(prompt, 'story_start')
                 story = response.text
                 request.session['story_context'] = story
                 request.session['story_history'] = [story]
@@ -132,7 +149,7 @@ def game(request):
                 Keep it under 250 words.
                 """
                 
-                response = model.generate_content(prompt)
+                response = _generate_content(prompt, 'story_continue')
                 new_story = response.text
                 
                 # Update story context and history
@@ -161,6 +178,7 @@ def game(request):
 def create_game_session(request):
     """Create a new game session and return the session ID"""
     if request.method == 'POST':
+        session_id = None
         try:
             # Parse JSON data from request
             data = json.loads(request.body)
@@ -193,10 +211,15 @@ def create_game_session(request):
             game_state['current_scene'] = initial_scene
             
             # Save to database
-            GameSession.objects.create(
-                session_id=uuid.UUID(session_id),
-                game_state=game_state
-            )
+            with tracing.span('db.save_game_session'):
+                game_session = GameSession.objects.create(
+                    session_id=uuid.UUID(session_id),
+                    game_state=game_state
+                )
+                
+                # The real portrait may have landed before the row existed
+                if _apply_landed_portrait(session_id, game_state):
+                    game_session.save()
             
             print(f"Game session saved to database with ID: {session_id}")
             
@@ -205,12 +228,16 @@ def create_game_session(request):
                 'session_id': session_id,
                 'scene_text': initial_scene.get('scene_text', ''),
                 'options': initial_scene.get('options', []),
-                'image_url': initial_scene.get('image_url', None)
+                'image_url': initial_scene.get('image_url', None),
+                'image_variants': initial_scene.get('image_variants', {}),
+                'image_pending': initial_scene.get('image_pending', False)
             })
             
         except Exception as e:
             print(f"Error creating session: {str(e)}")
             print(traceback.format_exc())
+            if session_id is not None:
+                _discard_landed_portrait(session_id)
             return JsonResponse({'error': str(e)}, status=400)
     
     return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
@@ -293,10 +320,14 @@ def make_choice(request, session_id):
             # Generate new scene based on the choice
             new_scene = _generate_scene_for_choice(request, session_id, game_state, selected_option)
             
-            # Update game state
-            game_state['current_scene'] = new_scene
-            game_session.game_state = game_state
-            game_session.save()
+            # Update game state; re-read the row so a portrait swapped in
+            # while the scene was generating is kept
+            with tracing.span('db.save_game_session'):
+                with transaction.atomic():
+                    game_session = GameSession.objects.select_for_update().get(session_id=session_id)
+                    game_session.game_state['story_history'] = game_state['story_history']
+                    game_session.game_state['current_scene'] = new_scene
+                    game_session.save()
             
             print(f"New scene generated and saved")
             
@@ -314,6 +345,126 @@ def make_choice(request, session_id):
     
     return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
 
+# Portraits that finished rendering before their session row was saved,
+# kept for LANDED_PORTRAIT_TTL seconds in case the session is never created
+LANDED_PORTRAIT_TTL = 600
+_landed_portraits = {}
+_landed_portraits_lock = threading.Lock()
+
+def _submit_character_image(image_prompt):
+    """Queue a portrait on the batching image worker; returns None if that fails"""
+    try:
+        return image_worker.get_batcher().submit(image_prompt)
+    except Exception as e:
+        print(f"❌ Error queueing character image: {str(e)}")
+        traceback.print_exc()
+        return None
+
+def _resolve_character_image(session_id, future, image_prompt, genre, wait):
+    """
+    Wait briefly for the real portrait. If it is not ready, store a procedural
+    placeholder and swap the real portrait in once it lands.
+    Returns (image_url, image_variants, image_pending).
+    """
+    if future is not None:
+        try:
+            with tracing.span('diffusion.wait'):
+                png_bytes = future.result(timeout=wait)
+            with tracing.span('store_session_image'):
+                image_variants = images.store_session_image(session_id, png_bytes)
+            print("✅ Character image generated successfully!")
+            return image_variants['native'], image_variants, False
+        except FutureTimeoutError:
+            print("⏳ Character image still rendering, serving a placeholder")
+        except Exception as e:
+            print(f"❌ Error generating character image: {str(e)}")
+            traceback.print_exc()  # Print full traceback
+            future = None
+    
+    with tracing.span('render_placeholder'):
+        image_variants = images.store_native_image(
+            session_id,
+            placeholders.render_placeholder_png(image_prompt, genre)
+        )
+    placeholder_url = image_variants['native']
+    
+    if future is not None:
+        future.add_done_callback(
+            functools.partial(_on_portrait_rendered, session_id, placeholder_url)
+        )
+    return placeholder_url, image_variants, future is not None
+
+def _on_portrait_rendered(session_id, placeholder_url, future):
+    """Runs on the image worker when a portrait finishes after its placeholder was served"""
+    try:
+        image_variants = images.store_session_image(session_id, future.result())
+    except Exception as e:
+        print(f"❌ Error generating character image: {str(e)}")
+        image_variants = None
+    
+    try:
+        with _landed_portraits_lock:
+            try:
+                with transaction.atomic():
+                    game_session = GameSession.objects.select_for_update().get(session_id=session_id)
+                    _swap_portrait(game_session.game_state, placeholder_url, image_variants)
+                    game_session.save()
+            except GameSession.DoesNotExist:
+                # create_game_session has not saved the session yet and will apply it
+                now = time.monotonic()
+                for stale_id in [key for key, (landed_at, *_) in _landed_portraits.items()
+                                 if now - landed_at > LANDED_PORTRAIT_TTL]:
+                    del _landed_portraits[stale_id]
+                _landed_portraits[session_id] = (now, placeholder_url, image_variants)
+    except Exception as e:
+        print(f"Error saving rendered portrait for session {session_id}: {str(e)}")
+        print(traceback.format_exc())
+
+def _apply_landed_portrait(session_id, game_state):
+    """Swap in a portrait that landed while the session was being created"""
+    with _landed_portraits_lock:
+        landed = _landed_portraits.pop(session_id, None)
+    if landed is None:
+        return False
+    _swap_portrait(game_state, *landed[1:])
+    return True
+
+def _discard_landed_portrait(session_id):
+    with _landed_portraits_lock:
+        _landed_portraits.pop(session_id, None)
+
+def _swap_portrait(game_state, placeholder_url, image_variants):
+    """Replace the placeholder with the real portrait wherever it is still shown"""
+    scene = game_state.get('current_scene') or {}
+    if scene.get('image_url') == placeholder_url:
+        if image_variants:
+            scene['image_url'] = image_variants['native']
+            scene['image_variants'] = image_variants
+        scene['image_pending'] = False
+    if image_variants:
+        game_state.setdefault('character', {})['portrait'] = image_variants
+
+def session_image(request, session_id, filename):
+    """Serve a stored session image; names are content hashes so they never change"""
+    try:
+        uuid.UUID(session_id)
+    except ValueError:
+        raise Http404('Image not found')
+    if not images.IMAGE_FILENAME_PATTERN.match(filename):
+        raise Http404('Image not found')
+    
+    path = images.image_path(session_id, filename)
+    if not os.path.exists(path):
+        raise Http404('Image not found')
+    
+    response = FileResponse(
+        open(path, 'rb'),
+        content_type=images.CONTENT_TYPES[filename.rsplit('.', 1)[1]]
+    )
+    response['Cache-Control'] = f'public, max-age={settings.GAME_IMAGE_CACHE_MAX_AGE}, immutable'
+    return response
+
+@tracing.traced('generate_initial_scene')
 def _generate_initial_scene(request, session_id, game_state):
     """Generate the initial scene for a new game"""
     try:
@@ -335,43 +486,20 @@ def _generate_initial_scene(request, session_id, game_state):
         
         # Generate character image
         print("\n🎨 Generating character image...")
-        try:
-            # Construct the prompt for the diffusion model
+        # Construct the prompt for the diffusion model
+        with tracing.span('build_image_prompt'):
             image_prompt = f"pixel art style, {character_background} {character_name}, "
             image_prompt += f"traits: {character_traits}, "
             image_prompt += f"description: {character_description}, "
             image_prompt += f"in a {world_genre} setting, "
             image_prompt += f"world: {world_description}"
-            
-            # Update the prompt in run_TestDiff.py
-            with open('run_TestDiff.py', 'r', encoding='utf-8') as file:
-                lines = file.readlines()
-            
-            # Find and replace the prompt line while preserving indentation
-            for i, line in enumerate(lines):
-                if line.strip().startswith('prompt ='):
-                    # Get the original indentation
-                    indentation = line[:line.find('prompt')]
-                    # Create the new line with the same indentation
-                    lines[i] = f'{indentation}prompt = "{image_prompt}"\n'
-                    break
-            
-            # Write the updated content back to the file
-            with open('run_TestDiff.py', 'w', encoding='utf-8') as file:
-                file.writelines(lines)
-            
-            # Run the diffusion model
-            import subprocess
-            subprocess.run(['python', 'run_TestDiff.py'], check=True, encoding='utf-8')
-            print("✅ Character image generated successfully!")
-            
-            # Add image URL to the scene data
-            image_url = "/pixel-art-xl-001.png"
-        except Exception as e:
-            print(f"❌ Error generating character image: {str(e)}")
-            print(f"❌ Error details: {str(e)}")
-            traceback.print_exc()  # Print full traceback
-            image_url = None
+        
+        # Queue the portrait so it renders while Gemini writes the scene.
+        # When the worker is saturated, don't wait for it at all.
+        saturated = image_worker.get_batcher().pending() >= settings.IMAGE_QUEUE_SATURATION
+        image_wait = 0 if saturated else settings.IMAGE_RENDER_WAIT_SECONDS
+        wait_deadline = time.monotonic() + image_wait
+        image_future = _submit_character_image(image_prompt)
         
         prompt = f"""
         You are starting a text-based role-playing game. Generate the opening scene based on the following:
@@ -393,22 +521,34 @@ def _generate_initial_scene(request, session_id, game_state):
                 "First choice for the player",
                 "Second choice for the player",
                 "Third choice for the player"
-            ],
-            "image_url": "{image_url}"
+            ]
         }}
         """
         
         # Use Gemini to generate the scene
-        response = model.generate_content(prompt)
+        try:
+            response = _generate_content(prompt, 'initial_scene')
+        finally:
+            image_url, image_variants, image_pending = _resolve_character_image(
+                session_id,
+                image_future,
+                image_prompt,
+                world_genre,
+                wait=max(0, wait_deadline - time.monotonic())
+            )
         
         # Parse the response
         try:
             # Try to extract JSON from the response
-            content = response.text
-            json_match = re.search(r'{.*}', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(0)
-            scene_data = json.loads(content)
+            with tracing.span('parse_scene_json'):
+                content = response.text
+                json_match = re.search(r'{.*}', content, re.DOTALL)
+                if json_match:
+                    content = json_match.group(0)
+                scene_data = json.loads(content)
+            scene_data['image_url'] = image_url
+            scene_data['image_variants'] = image_variants
+            scene_data['image_pending'] = image_pending
             print(f"Scene generated successfully")
             return scene_data
         except Exception as e:
@@ -422,7 +562,9 @@ def _generate_initial_scene(request, session_id, game_state):
                     "Look for other people",
                     "Check your belongings"
                 ],
-                "image_url": image_url
+                "image_url": image_url,
+                "image_variants": image_variants,
+                "image_pending": image_pending
             }
     except Exception as e:
         print(f"Error generating initial scene: {str(e)}")
@@ -438,6 +580,7 @@ def _generate_initial_scene(request, session_id, game_state):
             "image_url": None
         }
 
+@tracing.traced('generate_scene_for_choice')
 def _generate_scene_for_choice(request, session_id, game_state, selected_option):
     """Generate a new scene based on the player's choice"""
     try:
@@ -449,11 +592,12 @@ def _generate_scene_for_choice(request, session_id, game_state, selected_option)
         story_history = game_state.get('story_history', [])
         
         # Create a context summary from history
-        context = ""
-        for entry in story_history[-3:]:  # Use the last 3 entries for context
-            scene = entry.get('scene_text', '')
-            choice = entry.get('choice', '')
-            context += f"Scene: {scene}\nPlayer chose: {choice}\n\n"
+        with tracing.span('build_history_context'):
+            context = ""
+            for entry in story_history[-3:]:  # Use the last 3 entries for context
+                scene = entry.get('scene_text', '')
+                choice = entry.get('choice', '')
+                context += f"Scene: {scene}\nPlayer chose: {choice}\n\n"
         
         # Create prompt for Gemini
         prompt = f"""
@@ -479,16 +623,17 @@ def _generate_scene_for_choice(request, session_id, game_state, selected_option)
         """
         
         # Use Gemini to generate the scene
-        response = model.generate_content(prompt)
+        response = _generate_content(prompt, 'next_scene')
         
         # Parse the response
         try:
             # Try to extract JSON from the response
-            content = response.text
-            json_match = re.search(r'{.*}', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(0)
-            scene_data = json.loads(content)
+            with tracing.span('parse_scene_json'):
+                content = response.text
+                json_match = re.search(r'{.*}', content, re.DOTALL)
+                if json_match:
+                    content = json_match.group(0)
+                scene_data = json.loads(content)
             print(f"New scene generated successfully")
             return scene_data
         except Exception as e:
@@ -0,0 +1,173 @@
+"""
+Reading uploaded batches of project files and streaming projects back out.
+
+Uploads are a zip or (optionally compressed) tar archive, or a JSON list of
+``{"path": ..., "content": ...}`` objects. Only UTF-8 text files are kept;
+binary files, links and unsafe paths are reported as skipped. Archives are
+limited to BULK_UPLOAD_MAX_FILES files and BULK_UPLOAD_MAX_BYTES of
+uncompressed content.
+"""
+
+import posixpath
+import tarfile
+import zipfile
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# Longest File.path and File.name
+MAX_PATH_LENGTH = 1000
+MAX_NAME_LENGTH = 255
+
+
+class BulkUploadError(ValueError):
+    pass
+
+
+def normalize_path(path):
+    """A clean relative path, or None for empty paths or ones escaping the project"""
+    path = posixpath.normpath(str(path).replace('\\', '/').lstrip('/'))
+    if path in ('', '.') or path == '..' or path.startswith('../') or len(path) > MAX_PATH_LENGTH:
+        return None
+    return path
+
+
+class UploadBatch:
+    def __init__(self, max_files=None, max_bytes=None):
+        self.max_files = settings.BULK_UPLOAD_MAX_FILES if max_files is None else max_files
+        self.max_bytes = settings.BULK_UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+        # path -> content; a path given twice keeps its last content
+        self.files = {}
+        self.skipped = []
+        self.size = 0
+
+    def add(self, path, data):
+        normalized = normalize_path(path)
+        if normalized is None:
+            self.skipped.append({'path': str(path), 'reason': 'invalid path'})
+            return
+        if len(posixpath.basename(normalized)) > MAX_NAME_LENGTH:
+            self.skipped.append({'path': normalized, 'reason': 'file name too long'})
+            return
+        if isinstance(data, bytes):
+            try:
+                data = data.decode('utf-8')
+            except UnicodeDecodeError:
+                self.skipped.append({'path': normalized, 'reason': 'not a UTF-8 text file'})
+                return
+        if '\x00' in data:
+            self.skipped.append({'path': normalized, 'reason': 'not a UTF-8 text file'})
+            return
+        self._reserve(normalized, len(data.encode('utf-8')))
+        self.files[normalized] = data
+
+    def read_archive(self, upload):
+        """Add every file of an uploaded zip or tar archive"""
+        if zipfile.is_zipfile(upload):
+            upload.seek(0)
+            self._read_zip(upload)
+            return
+        upload.seek(0)
+        try:
+            with tarfile.open(fileobj=upload, mode='r:*') as archive:
+                self._read_tar(archive)
+        except tarfile.ReadError as e:
+            raise BulkUploadError('Not a zip or tar archive') from e
+        except tarfile.TarError as e:
+            raise BulkUploadError(f'Invalid tar archive: {e}') from e
+
+    def read_json(self, entries):
+        """Add files from a JSON batch of {"path", "content"} objects"""
+        if not isinstance(entries, list):
+            raise BulkUploadError('files must be a list of {"path", "content"} objects')
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get('path'), str):
+                raise BulkUploadError('files must be a list of {"path", "content"} objects')
+            content = entry.get('content', '')
+            if not isinstance(content, str):
+                raise BulkUploadError(f"Content of {entry['path']} must be a string")
+            self.add(entry['path'], content)
+
+    def _reserve(self, path, size):
+        if path not in self.files and len(self.files) >= self.max_files:
+            raise BulkUploadError(f'Uploads are limited to {self.max_files} files')
+        self.size += size
+        if self.size > self.max_bytes:
+            raise BulkUploadError(f'Uploads are limited to {self.max_bytes} bytes of content')
+
+    def _read_zip(self, upload):
+        try:
+            with zipfile.ZipFile(upload) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    # Check the declared size before inflating anything
+                    if self.size + info.file_size > self.max_bytes:
+                        raise BulkUploadError(f'Uploads are limited to {self.max_bytes} bytes of content')
+                    self.add(info.filename, archive.read(info))
+        except zipfile.BadZipFile as e:
+            raise BulkUploadError(f'Invalid zip archive: {e}') from e
+
+    def _read_tar(self, archive):
+        for member in archive:
+            if member.isdir():
+                continue
+            if not member.isfile():
+                self.skipped.append({'path': member.name, 'reason': 'not a regular file'})
+                continue
+            if self.size + member.size > self.max_bytes:
+                raise BulkUploadError(f'Uploads are limited to {self.max_bytes} bytes of content')
+            self.add(member.name, archive.extractfile(member).read())
+
+
+class _ZipStream:
+    """Write-only file object handing out what has been written so far"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files):
+    """
+    Yield a zip archive of ``(path, content)`` pairs piece by piece, so large
+    projects are never held in memory whole
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for path, content in files:
+            archive.writestr(path, content)
+            data = stream.take()
+            if data:
+                yield data
+    yield stream.take()
+
+
+async def iterate_in_thread(iterator):
+    """
+    Async iterator over a blocking one (such as a queryset-backed generator),
+    advanced in the thread Django runs sync code in. Lets ASGI stream the
+    response instead of collecting it into a list first
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    done = object()
+    while True:
+        chunk = await next_chunk(iterator, done)
+        if chunk is done:
+            return
+        yield chunk
\ No newline at end of file
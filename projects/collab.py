@@ -0,0 +1,419 @@
+"""
+Server-side state of files being edited live over the project WebSocket.
+
+Each open file has one authoritative in-memory Document holding its current
+text and revision. Clients send small operations against the revision they
+last saw:
+
+    {'type': 'insert', 'position': 4, 'text': 'abc'}
+    {'type': 'delete', 'position': 4, 'length': 3}
+
+Positions count Unicode code points. Operations made against an older
+revision are transformed (OT) over the ones applied since, applied, and
+only the transformed operations are broadcast. Clients keep one batch of
+operations in flight, buffering later edits until the broadcast carrying
+their op_id comes back, and rebase in-flight and buffered operations over
+other broadcasts with ``transform``. On ties between inserts at the same
+position, the operation applied first stays first.
+
+Dirty documents are written back to File every FILE_EDIT_PERSIST_INTERVAL
+seconds. When the last editor closes the file, a FileVersion is recorded
+and the file is indexed for code search. Documents live in the process that serves the project's sockets, so
+all of a project's WebSocket connections must reach the same ASGI worker.
+
+When a file changes outside the live session (an API update, a restore or
+a bulk upload), its open document takes the new text and editors are sent
+a fresh file_state; unsaved operations are dropped. Saves that leave the
+content as it was do not disturb the session.
+
+Cursor and selection updates are not part of the document. They are
+coalesced with UpdateCoalescer: only the latest position of each user and
+file survives a CURSOR_BROADCAST_INTERVAL window, once when it is sent to
+the room and again when it is delivered to each client, batched into a
+single frame.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+from users.models import User
+from .models import File, FileVersion
+from .search import index_file
+
+logger = logging.getLogger(__name__)
+
+
+class OperationError(ValueError):
+    pass
+
+
+def _insert(position, text):
+    return {'type': 'insert', 'position': position, 'text': text}
+
+
+def _delete(position, length):
+    return {'type': 'delete', 'position': position, 'length': length}
+
+
+def validate_ops(ops):
+    """Normalize client-supplied operations, raising OperationError if malformed"""
+    if not isinstance(ops, list) or not ops:
+        raise OperationError('ops must be a non-empty list')
+    normalized = []
+    for op in ops:
+        if not isinstance(op, dict) or not isinstance(op.get('position'), int) or op['position'] < 0:
+            raise OperationError(f'Invalid operation {op!r}')
+        if op.get('type') == 'insert' and isinstance(op.get('text'), str):
+            if op['text']:
+                normalized.append(_insert(op['position'], op['text']))
+        elif op.get('type') == 'delete' and isinstance(op.get('length'), int) and op['length'] >= 0:
+            if op['length']:
+                normalized.append(_delete(op['position'], op['length']))
+        else:
+            raise OperationError(f'Invalid operation {op!r}')
+    return normalized
+
+
+def apply_ops(text, ops):
+    """Apply operations in order to ``text``"""
+    for op in ops:
+        position = op['position']
+        if op['type'] == 'insert':
+            if position > len(text):
+                raise OperationError(f'Insert at {position} is past the end of the document')
+            text = text[:position] + op['text'] + text[position:]
+        else:
+            if position + op['length'] > len(text):
+                raise OperationError(f'Delete of {position}:{position + op["length"]} is past the end of the document')
+            text = text[:position] + text[position + op['length']:]
+    return text
+
+
+def _transform_op(op, other, op_first):
+    """
+    Rewrite ``op`` to apply after ``other``, both made against the same
+    text. ``op_first`` breaks ties between inserts at the same position.
+    Returns a list, as a delete spanning an insert is split in two
+    """
+    position = op['position']
+    if other['type'] == 'insert':
+        other_length = len(other['text'])
+        if op['type'] == 'insert':
+            if other['position'] < position or (other['position'] == position and not op_first):
+                position += other_length
+            return [_insert(position, op['text'])]
+        end = position + op['length']
+        if other['position'] <= position:
+            return [_delete(position + other_length, op['length'])]
+        if other['position'] >= end:
+            return [op]
+        # The insert lands inside the deleted range and survives it
+        before = other['position'] - position
+        return [_delete(position, before), _delete(position + other_length, op['length'] - before)]
+
+    other_end = other['position'] + other['length']
+    if op['type'] == 'insert':
+        if position <= other['position']:
+            return [op]
+        return [_insert(max(position - other['length'], other['position']), op['text'])]
+
+    end = position + op['length']
+    overlap = max(0, min(end, other_end) - max(position, other['position']))
+    length = op['length'] - overlap
+    if not length:
+        return []
+    if other['position'] < position:
+        position = max(position - other['length'], other['position'])
+    return [_delete(position, length)]
+
+
+def transform(ops, others, ops_first=False):
+    """
+    Transform two lists of operations made against the same text over each
+    other. Returns ``(ops', others')``: applying ``others`` then ``ops'``
+    gives the same text as applying ``ops`` then ``others'``
+    """
+    if not ops or not others:
+        return ops, others
+    if len(ops) > 1:
+        head, others = transform(ops[:1], others, ops_first)
+        tail, others = transform(ops[1:], others, ops_first)
+        return head + tail, others
+    if len(others) > 1:
+        ops, head = transform(ops, others[:1], ops_first)
+        ops, tail = transform(ops, others[1:], ops_first)
+        return ops, head + tail
+    return (
+        _transform_op(ops[0], others[0], ops_first),
+        _transform_op(others[0], ops[0], not ops_first)
+    )
+
+
+class Document:
+    def __init__(self, file_id, project_id, content, updated_at, history_size):
+        self.file_id = file_id
+        self.project_id = project_id
+        self.content = content
+        self.revision = 0
+        # (revision, ops) of the latest applied operations, oldest first
+        self.history = deque(maxlen=history_size)
+        self.saved_revision = 0
+        self.saved_at = updated_at
+        # The text as of saved_at, to tell real outside changes from saves
+        # that left the content alone
+        self.saved_content = content
+        self.last_editor_id = None
+        self.editors = set()
+
+    @property
+    def dirty(self):
+        return self.revision != self.saved_revision
+
+    def apply(self, revision, ops, user_id=None):
+        """
+        Apply operations a client made against ``revision``; returns the
+        transformed operations and the document's new revision
+        """
+        if not isinstance(revision, int) or revision > self.revision:
+            raise OperationError(f'Unknown revision {revision!r}')
+        missed = self.revision - revision
+        if missed > len(self.history):
+            raise OperationError(f'Revision {revision} is too old; reopen the file')
+
+        for _, applied in list(self.history)[len(self.history) - missed:]:
+            ops, _ = transform(ops, applied)
+        self.content = apply_ops(self.content, ops)
+        self.revision += 1
+        self.history.append((self.revision, ops))
+        if user_id is not None:
+            self.last_editor_id = user_id
+        return ops, self.revision
+
+    def reset(self, content, updated_at):
+        """Replace the text after it changed outside the live session"""
+        self.content = content
+        self.revision += 1
+        # Operations against older revisions cannot be rebased any more
+        self.history.clear()
+        self.saved_revision = self.revision
+        self.saved_at = updated_at
+        self.saved_content = content
+
+    def state(self):
+        return {'file_id': str(self.file_id), 'content': self.content, 'revision': self.revision}
+
+
+class UpdateCoalescer:
+    """
+    Keeps the latest update per key and hands them to ``flush`` together,
+    at most once per ``interval`` seconds
+    """
+
+    def __init__(self, interval, flush):
+        self.interval = interval
+        self.flush = flush
+        self._pending = {}
+        self._task = None
+
+    def put(self, key, update):
+        # Re-inserting moves the key last, so batches keep arrival order
+        self._pending.pop(key, None)
+        self._pending[key] = update
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_later())
+
+    def cancel(self):
+        """Drop pending updates"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._pending = {}
+
+    async def flush_now(self):
+        """Hand over pending updates without waiting for the interval"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self._flush_pending()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        self._task = None
+        await self._flush_pending()
+
+    async def _flush_pending(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await self.flush(list(pending.values()))
+        except Exception:
+            logger.exception('Could not flush coalesced updates')
+
+
+class DocumentStore:
+    def __init__(self, persist_interval, history_size):
+        self.persist_interval = persist_interval
+        self.history_size = history_size
+        self._documents = {}
+        self._loading = {}
+        self._persister = None
+
+    async def open(self, file_id, project_id, editor):
+        """
+        Document for a file of ``project_id``, loaded on first use. ``editor``
+        identifies the connection until it calls close
+        """
+        file_id = str(file_id)
+        document = self._documents.get(file_id)
+        if document is not None:
+            # The file may have changed since it was loaded
+            await self._refresh(document)
+            document = self._documents.get(file_id)
+        if document is None:
+            # Concurrent opens share one load
+            loading = self._loading.get(file_id)
+            if loading is None:
+                loading = asyncio.ensure_future(self._load(file_id, project_id))
+                self._loading[file_id] = loading
+            try:
+                document = await loading
+            finally:
+                self._loading.pop(file_id, None)
+            document = self._documents.setdefault(file_id, document)
+        if str(document.project_id) != str(project_id):
+            raise File.DoesNotExist(f'File {file_id} is not in project {project_id}')
+
+        document.editors.add(editor)
+        self._start_persister()
+        return document
+
+    def get(self, file_id, editor):
+        """An open document, if ``editor`` opened it"""
+        document = self._documents.get(str(file_id))
+        if document is None or editor not in document.editors:
+            return None
+        return document
+
+    async def close(self, file_id, editor):
+        """Release a document; the last editor out saves it and records a version"""
+        document = self._documents.get(str(file_id))
+        if document is None:
+            return
+        document.editors.discard(editor)
+        if document.editors:
+            return
+        try:
+            await self._save(document)
+            if document.editors:
+                return
+            await database_sync_to_async(self._record_version)(document)
+        except Exception:
+            logger.exception(f'Could not save document {document.file_id}')
+        if not document.editors:
+            self._documents.pop(str(file_id), None)
+
+    async def refresh(self, file_id):
+        """
+        Catch an open document up with its file after a change made outside
+        the live session (an API update, a restore or a bulk upload)
+        """
+        document = self._documents.get(str(file_id))
+        if document is not None:
+            await self._refresh(document)
+
+    async def flush(self):
+        """Save every document with unsaved operations"""
+        for document in list(self._documents.values()):
+            if document.dirty:
+                try:
+                    await self._save(document)
+                except Exception:
+                    logger.exception(f'Could not save document {document.file_id}')
+
+    def _start_persister(self):
+        if self._persister is None or self._persister.done():
+            self._persister = asyncio.ensure_future(self._persist_periodically())
+
+    async def _persist_periodically(self):
+        while self._documents:
+            await asyncio.sleep(self.persist_interval)
+            await self.flush()
+
+    async def _load(self, file_id, project_id):
+        file = await database_sync_to_async(
+            File.objects.only('id', 'project_id', 'content', 'updated_at').get
+        )(id=file_id, project_id=project_id)
+        return Document(file.id, file.project_id, file.content, file.updated_at, self.history_size)
+
+    async def _save(self, document):
+        if not document.dirty:
+            return
+        revision, content, saved_at = document.revision, document.content, document.saved_at
+        now = timezone.now()
+        # Only overwrite the row if nothing else changed it since our last save
+        saved = await database_sync_to_async(
+            File.objects.filter(id=document.file_id, updated_at=saved_at).update
+        )(content=content, updated_at=now)
+        if saved:
+            document.saved_revision = revision
+            document.saved_at = now
+            document.saved_content = content
+            return
+        # Changed outside the live session meanwhile
+        await self._refresh(document)
+
+    async def _refresh(self, document):
+        saved_at = document.saved_at
+        try:
+            file = await database_sync_to_async(File.objects.only('content', 'updated_at').get)(id=document.file_id)
+        except File.DoesNotExist:
+            document.editors.clear()
+            self._documents.pop(str(document.file_id), None)
+            return
+        if document.saved_at != saved_at or file.updated_at == saved_at:
+            # Saved by us while loading, or unchanged
+            return
+        if file.content == document.saved_content:
+            # Saved again without a change; unsaved edits still apply
+            document.saved_at = file.updated_at
+            return
+
+        # That version wins, and editors are sent the new text to continue from
+        if document.dirty:
+            logger.warning(f'File {document.file_id} changed outside the live session; discarding unsaved edits')
+        document.reset(file.content, file.updated_at)
+        await get_channel_layer().group_send(
+            f'project_{document.project_id}',
+            {'type': 'file_state', 'state': document.state()}
+        )
+
+    def _record_version(self, document):
+        file = File.objects.only('id', 'project_id', 'path', 'content').get(id=document.file_id)
+        index_file(file)
+        latest = FileVersion.objects.filter(file_id=document.file_id).order_by('-created_at').first()
+        if latest is not None and latest.full_content == document.content:
+            return
+        FileVersion.objects.create_version(
+            file=file,
+            content=document.content,
+            created_by=User.objects.filter(id=document.last_editor_id).first()
+        )
+
+
+_store = None
+
+
+def get_document_store():
+    """Process-wide store of live documents"""
+    global _store
+    if _store is None:
+        _store = DocumentStore(
+            persist_interval=settings.FILE_EDIT_PERSIST_INTERVAL,
+            history_size=settings.FILE_EDIT_HISTORY_SIZE
+        )
+    return _store
\ No newline at end of file
@@ -1,9 +1,18 @@
+import asyncio
 import json
+import logging
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Project, File
+from .collab import OperationError, UpdateCoalescer, get_document_store, validate_ops
+from .models import File
+from .permissions import EDIT_ROLES, get_project_role
+from .presence import PresenceError, active_users, project_presence
 from users.models import User
 
+logger = logging.getLogger(__name__)
+
 class ProjectConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.project_id = self.scope['url_route']['kwargs']['project_id']
@@ -13,6 +22,14 @@ class ProjectConsumer(AsyncWebsocketConsumer):
         if not await self.user_can_access_project():
             await self.close()
             return
+        self.can_edit = self.role in EDIT_ROLES
+        self.open_files = set()
+        self.presence = None
+        self.heartbeat_task = None
+        # Our user's cursor updates on their way to the room, and other
+        # users' updates on their way to this client
+        self.outgoing_cursors = UpdateCoalescer(settings.CURSOR_BROADCAST_INTERVAL, self.broadcast_cursors)
+        self.incoming_cursors = UpdateCoalescer(settings.CURSOR_BROADCAST_INTERVAL, self.send_cursors)
         
         # Join room group
         await self.channel_layer.group_add(
@@ -26,65 +43,64 @@ class ProjectConsumer(AsyncWebsocketConsumer):
         await self.send_active_users()
     
     async def disconnect(self, close_code):
+        # Others still get our last cursor position
+        if getattr(self, 'outgoing_cursors', None) is not None:
+            await self.outgoing_cursors.flush_now()
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        if getattr(self, 'incoming_cursors', None) is not None:
+            self.incoming_cursors.cancel()
+        
+        if getattr(self, 'heartbeat_task', None) is not None:
+            self.heartbeat_task.cancel()
+        
+        # Release live documents this connection had open
+        for file_id in getattr(self, 'open_files', ()):
+            await get_document_store().close(file_id, self.channel_name)
         
         # Notify others that user has left
-        if hasattr(self, 'user_id'):
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_event',
-                    'event': {
-                        'action': 'left',
-                        'user_id': self.user_id,
-                        'username': self.username
-                    }
-                }
-            )
+        if getattr(self, 'presence', None) is not None:
+            try:
+                left = await self.presence.leave()
+            except PresenceError as e:
+                logger.warning(f"Could not update presence for project {self.project_id}: {e}")
+                left = False
+            if left:
+                await self.send_user_event('left', self.presence.user_id, self.scope['user'].username)
     
     # Receive message from WebSocket
     async def receive(self, text_data):
         data = json.loads(text_data)
         message_type = data.get('type')
         
-        if message_type == 'join':
-            # User joining the project
-            self.user_id = data.get('user_id')
-            self.username = data.get('username')
-            
-            # Notify others that user has joined
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_event',
-                    'event': {
-                        'action': 'joined',
-                        'user_id': self.user_id,
-                        'username': self.username
-                    }
-                }
-            )
+        if message_type == 'open_file':
+            await self.open_file(data.get('file_id'))
+        
+        elif message_type == 'close_file':
+            file_id = str(data.get('file_id'))
+            if file_id in self.open_files:
+                self.open_files.discard(file_id)
+                await get_document_store().close(file_id, self.channel_name)
+        
+        elif message_type == 'file_op':
+            await self.apply_file_op(data)
         
         elif message_type == 'file_edit':
-            # User editing a file
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'file_edit',
-                    'edit': {
-                        'file_id': data.get('file_id'),
-                        'user_id': data.get('user_id'),
-                        'username': data.get('username'),
-                        'cursor_position': data.get('cursor_position'),
-                        'content': data.get('content'),
-                        'selection': data.get('selection')
-                    }
-                }
-            )
+            # Cursor and selection updates; text changes go through file_op.
+            # Only the latest position per file is sent on each tick
+            user = self.scope['user']
+            file_id = str(data.get('file_id'))
+            self.outgoing_cursors.put(file_id, {
+                'file_id': file_id,
+                'user_id': str(user.id),
+                'username': user.username,
+                'cursor_position': data.get('cursor_position'),
+                'selection': data.get('selection')
+            })
         
         elif message_type == 'chat_message':
             # User sending a chat message
@@ -101,6 +117,75 @@ class ProjectConsumer(AsyncWebsocketConsumer):
                 }
             )
     
+    async def open_file(self, file_id):
+        try:
+            document = await get_document_store().open(file_id, self.project_id, self.channel_name)
+        except (File.DoesNotExist, ValueError, ValidationError):
+            await self.send_error('File not found', file_id)
+            return
+        
+        self.open_files.add(str(document.file_id))
+        await self.send(text_data=json.dumps({
+            'type': 'file_state',
+            'state': document.state()
+        }))
+    
+    async def apply_file_op(self, data):
+        file_id = str(data.get('file_id'))
+        if not self.can_edit:
+            await self.send_error('You do not have permission to edit files in this project', file_id)
+            return
+        document = get_document_store().get(file_id, self.channel_name)
+        if document is None:
+            await self.send_error('Open the file before editing it', file_id)
+            return
+        
+        user = self.scope['user']
+        try:
+            ops, revision = document.apply(data.get('revision'), validate_ops(data.get('ops')), user.id)
+        except OperationError as e:
+            await self.send_error(str(e), file_id)
+            return
+        
+        # Only the (transformed) operations go out, not the whole file
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'file_op',
+                'op': {
+                    'file_id': file_id,
+                    'revision': revision,
+                    'ops': ops,
+                    'op_id': data.get('op_id'),
+                    'user_id': str(user.id),
+                    'username': user.username
+                }
+            }
+        )
+    
+    async def broadcast_cursors(self, edits):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'file_edit',
+                'edits': edits,
+                'sender': self.channel_name
+            }
+        )
+    
+    async def send_cursors(self, edits):
+        await self.send(text_data=json.dumps({
+            'type': 'cursor_batch',
+            'edits': edits
+        }))
+    
+    async def send_error(self, message, file_id=None):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'error': message,
+            'file_id': file_id
+        }))
+    
     # Receive message from room group
     async def user_event(self, event):
         # Send message to WebSocket
@@ -110,19 +195,52 @@ class ProjectConsumer(AsyncWebsocketConsumer):
         }))
     
     async def file_edit(self, event):
+        # Collect the room's cursor updates into one frame per tick
+        if event['sender'] == self.channel_name:
+            return
+        for edit in event['edits']:
+            self.incoming_cursors.put((edit['user_id'], edit['file_id']), edit)
+    
+    async def file_op(self, event):
+        # Send message to WebSocket
+        await self.send(text_data=json.dumps({
+            'type': 'file_op',
+            'op': event['op']
+        }))
+    
+    async def file_state(self, event):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
-            'type': 'file_edit',
-            'edit': event['edit']
+            'type': 'file_state',
+            'state': event['state']
         }))
     
     async def file_event(self, event):
+        # Open documents pick up changes made outside the live session
+        await self.refresh_documents(event['event'])
+        
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'type': 'file_event',
             'event': event['event']
         }))
     
+    async def refresh_documents(self, event):
+        if event['action'] == 'bulk_upload':
+            file_ids = [file['file_id'] for file in event['files'] if file['action'] == 'updated']
+        elif event['action'] == 'updated':
+            file_ids = [event['file_id']]
+        else:
+            return
+        store = get_document_store()
+        for file_id in file_ids:
+            if store.get(file_id, self.channel_name) is None:
+                continue
+            try:
+                await store.refresh(file_id)
+            except Exception:
+                logger.exception(f"Could not refresh document {file_id}")
+    
     async def chat_message(self, event):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
@@ -130,25 +248,89 @@ class ProjectConsumer(AsyncWebsocketConsumer):
             'message': event['message']
         }))
     
-    @database_sync_to_async
-    def user_can_access_project(self):
-        # Get user from scope
-        user = self.scope.get('user')
-        if not user or user.is_anonymous:
-            return False
-        
-        try:
-            project = Project.objects.get(id=self.project_id)
-            # Check if user is owner or collaborator
-            return (project.owner_id == user.id or 
-                    project.collaborators.filter(id=user.id).exists())
-        except Project.DoesNotExist:
-            return False
+    async def execution_update(self, event):
+        # Send message to WebSocket
+        await self.send(text_data=json.dumps({
+            'type': 'execution_update',
+            'execution': event['execution']
+        }))
+    
+    async def role_changed(self, event):
+        # A collaborator entry changed; re-check it if it is ours
+        if event['user_id'] != str(self.scope['user'].id):
+            return
+        if not await self.user_can_access_project():
+            await self.send(text_data=json.dumps({
+                'type': 'access_revoked',
+                'project_id': str(self.project_id)
+            }))
+            await self.close()
+            return
+        self.can_edit = self.role in EDIT_ROLES
+    
+    async def execution_queue(self, event):
+        # Send message to WebSocket
+        await self.send(text_data=json.dumps({
+            'type': 'execution_queue',
+            'positions': event['positions']
+        }))
+    
+    async def execution_output(self, event):
+        # Send message to WebSocket
+        await self.send(text_data=json.dumps({
+            'type': 'execution_output',
+            'output': event['output']
+        }))
+    
+    async def user_can_access_project(self):
+        # Resolve the user's role once for the whole connection
+        self.role = await database_sync_to_async(get_project_role)(self.scope.get('user'), self.project_id)
+        return self.role is not None
     
     async def send_active_users(self):
-        # This would be implemented with a Redis store in production
-        # For simplicity, we're not tracking active users in this example
+        # Registering the connection returns everyone present in the same
+        # Redis round trip
+        user = self.scope['user']
+        self.presence = project_presence(self.project_id, self.channel_name, user)
+        try:
+            members, first, departed = await self.presence.join()
+        except PresenceError as e:
+            logger.warning(f"Could not update presence for project {self.project_id}: {e}")
+            members, first, departed = [], False, []
+        
         await self.send(text_data=json.dumps({
             'type': 'active_users',
-            'users': []
-        }))
\ No newline at end of file
+            'users': active_users(members)
+        }))
+        
+        if first:
+            await self.send_user_event('joined', self.presence.user_id, user.username)
+        # Users whose connections stopped heartbeating without closing
+        for gone in departed:
+            await self.send_user_event('left', gone['user_id'], gone['username'])
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+    
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                departed = await self.presence.heartbeat()
+            except PresenceError as e:
+                logger.warning(f"Could not update presence for project {self.project_id}: {e}")
+                continue
+            # Users whose connections stopped heartbeating without closing
+            for user in departed:
+                await self.send_user_event('left', user['user_id'], user['username'])
+    
+    async def send_user_event(self, action, user_id, username):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'user_event',
+                'event': {
+                    'action': action,
+                    'user_id': user_id,
+                    'username': username
+                }
+            }
+        )
\ No newline at end of file
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from projects.models import File, FileSearchTerm
+from projects.search import index_files
+
+
+class Command(BaseCommand):
+    help = 'Create the code search index table if it is missing and index every file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Files indexed per transaction (default: 200)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        self.create_missing_table()
+
+        batch = []
+        count = 0
+        for file in File.objects.only('id', 'project_id', 'path', 'content').iterator(chunk_size=batch_size):
+            batch.append(file)
+            if len(batch) == batch_size:
+                index_files(batch)
+                count += len(batch)
+                batch = []
+        index_files(batch)
+        count += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} files'))
+
+    def create_missing_table(self):
+        if FileSearchTerm._meta.db_table in connection.introspection.table_names():
+            return
+        self.stdout.write(f'Creating {FileSearchTerm._meta.db_table}')
+        with connection.schema_editor() as editor:
+            editor.create_model(FileSearchTerm)
\ No newline at end of file
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
 import uuid
 from users.models import User
+from .versioning import apply_delta, make_delta
 
 class Project(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -49,15 +52,147 @@ class File(models.Model):
     def __str__(self):
         return f"{self.project.name}/{self.path}"
 
+class FileVersionManager(models.Manager):
+    def create_version(self, file, content, created_by=None):
+        """
+        Record a new version of a file, stored as a delta against the latest
+        version unless a snapshot is due or the delta would not be smaller
+        """
+        previous = self.filter(file=file).order_by('-created_at').first()
+        fields = {'content': content}
+        if previous is not None and previous.chain_depth + 1 < settings.FILE_VERSION_SNAPSHOT_INTERVAL:
+            delta = make_delta(previous.full_content, content)
+            if len(delta) < len(content):
+                fields = {
+                    'content': '',
+                    'delta': delta,
+                    'base': previous,
+                    'snapshot_id': previous.snapshot_id or previous.id,
+                    'chain_depth': previous.chain_depth + 1
+                }
+        return self.create(file=file, created_by=created_by, **fields)
+    
+    def bulk_create_versions(self, files, created_by=None):
+        """
+        Record the current content of many files as new versions, with a
+        fixed number of queries instead of a few per file
+        """
+        files = list(files)
+        latest_ids = File.objects.filter(id__in=[file.id for file in files]).annotate(
+            latest_id=models.Subquery(
+                self.filter(file=models.OuterRef('pk')).order_by('-created_at').values('id')[:1]
+            )
+        ).values_list('latest_id', flat=True)
+        previous = {
+            version.file_id: version
+            for version in self.load_contents(self.filter(id__in=[id for id in latest_ids if id is not None]))
+        }
+        
+        versions = []
+        for file in files:
+            version = self.model(file=file, content=file.content, created_by=created_by)
+            latest = previous.get(file.id)
+            if latest is not None and latest.chain_depth + 1 < settings.FILE_VERSION_SNAPSHOT_INTERVAL:
+                delta = make_delta(latest.full_content, file.content)
+                if len(delta) < len(file.content):
+                    version.content = ''
+                    version.delta = delta
+                    version.base = latest
+                    version.snapshot_id = latest.snapshot_id or latest.id
+                    version.chain_depth = latest.chain_depth + 1
+            versions.append(version)
+        return self.bulk_create(versions)
+    
+    def load_contents(self, versions):
+        """
+        Reconstruct the content of several versions, fetching every delta
+        chain involved in a single query
+        """
+        versions = list(versions)
+        snapshot_ids = {
+            version.snapshot_id for version in versions
+            if not version.is_snapshot and not hasattr(version, '_full_content')
+        }
+        if snapshot_ids:
+            chain = {
+                version.id: version
+                for version in self.filter(Q(id__in=snapshot_ids) | Q(snapshot_id__in=snapshot_ids))
+            }
+            for version in versions:
+                version._resolve(chain)
+        return versions
+
 class FileVersion(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='versions')
-    content = models.TextField()
+    # Full text for snapshots; empty for versions stored as a delta
+    content = models.TextField(blank=True)
+    delta = models.TextField(blank=True)
+    # Version the delta applies to, and the snapshot its chain starts from
+    base = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    snapshot = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    chain_depth = models.PositiveIntegerField(default=0)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = FileVersionManager()
+    
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
-        return f"{self.file.path} - {self.created_at}"
\ No newline at end of file
+        return f"{self.file.path} - {self.created_at}"
+    
+    @property
+    def is_snapshot(self):
+        return self.snapshot_id is None
+    
+    @property
+    def full_content(self):
+        """The version's content, rebuilt from its snapshot and deltas if needed"""
+        if not hasattr(self, '_full_content'):
+            if self.is_snapshot:
+                self._full_content = self.content
+            else:
+                chain = {
+                    version.id: version
+                    for version in FileVersion.objects.filter(
+                        Q(id=self.snapshot_id) |
+                        Q(snapshot_id=self.snapshot_id, chain_depth__lt=self.chain_depth)
+                    )
+                }
+                self._resolve(chain)
+        return self._full_content
+    
+    def _resolve(self, chain):
+        # Walk back to the nearest version with known content, then apply
+        # the deltas forwards
+        pending = []
+        version = self
+        while not hasattr(version, '_full_content') and not version.is_snapshot:
+            pending.append(version)
+            version = chain.get(version.base_id)
+            if version is None:
+                raise ValueError(f"Version chain of {self.id} is incomplete")
+        if not hasattr(version, '_full_content'):
+            version._full_content = version.content
+        
+        content = version._full_content
+        for version in reversed(pending):
+            content = apply_delta(content, version.delta)
+            version._full_content = content
+
+class FileSearchTerm(models.Model):
+    """One entry of the inverted index used by project code search"""
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='+')
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+    # Occurrences in the file, with matches in the path weighted higher
+    count = models.PositiveIntegerField()
+    
+    class Meta:
+        unique_together = ('file', 'term')
+        indexes = [models.Index(fields=['project', 'term'])]
+    
+    def __str__(self):
+        return f"{self.term} in {self.file_id}"
\ No newline at end of file
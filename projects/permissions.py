@@ -0,0 +1,124 @@
+"""
+Resolution of a user's role in a project.
+
+A role is 'owner', 'admin', 'editor' or 'viewer', or None for users without
+access (or projects that do not exist). It is loaded with a single query,
+kept for PROJECT_ROLE_CACHE_TTL seconds in the shared PROJECT_ROLE_CACHE
+cache and memoized on the request, so permission checks repeated within a
+request are free. A per-process cache would let other workers keep a stale
+role after a change, so roles are not cached across requests unless the
+cache is shared. Changing a collaborator must call invalidate_project_role,
+which also tells the project's open WebSocket connections to resolve the
+user's role again.
+"""
+
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.db.models import OuterRef, Subquery
+from codehive import metrics
+from .models import Project, ProjectCollaborator
+
+logger = logging.getLogger(__name__)
+
+OWNER = 'owner'
+# Roles allowed to change files, and to manage collaborators
+EDIT_ROLES = (OWNER, 'admin', 'editor')
+MANAGE_ROLES = (OWNER, 'admin')
+
+# Cached for users without access, as the cache cannot store None
+_NO_ROLE = ''
+
+
+def _cache_key(project_id, user_id):
+    return f'project_role:{project_id}:{user_id}'
+
+
+def _role_cache():
+    """The shared cache roles are kept in, or None if there is none"""
+    alias = settings.PROJECT_ROLE_CACHE
+    if not alias or alias not in settings.CACHES:
+        return None
+    cache = caches[alias]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return None
+    return cache
+
+
+def _load_role(project_id, user_id):
+    try:
+        row = Project.objects.filter(id=project_id).annotate(
+            collaborator_role=Subquery(
+                ProjectCollaborator.objects.filter(project=OuterRef('pk'), user_id=user_id).values('role')[:1]
+            )
+        ).values_list('owner_id', 'collaborator_role').first()
+    except ValidationError:
+        # Not a valid project id
+        return None
+    if row is None:
+        return None
+    owner_id, role = row
+    return OWNER if owner_id == user_id else role
+
+
+def get_project_role(user, project_id, request=None):
+    """The user's role in a project, or None if they have no access"""
+    if user is None or not user.is_authenticated:
+        return None
+    project_id = str(project_id)
+
+    roles = getattr(request, '_project_roles', None)
+    if roles is not None and project_id in roles:
+        return roles[project_id]
+
+    cache = _role_cache()
+    key = _cache_key(project_id, user.id)
+    role = None
+    if cache is not None:
+        try:
+            role = cache.get(key)
+        except Exception as e:
+            logger.warning(f"Could not read cached project role: {e}")
+            cache = None
+        metrics.record_cache_lookup('project_role', role is not None)
+    if role is None:
+        role = _load_role(project_id, user.id) or _NO_ROLE
+        if cache is not None:
+            try:
+                cache.set(key, role, settings.PROJECT_ROLE_CACHE_TTL)
+            except Exception as e:
+                logger.warning(f"Could not cache project role: {e}")
+    role = role or None
+
+    if request is not None:
+        if roles is None:
+            roles = request._project_roles = {}
+        roles[project_id] = role
+    return role
+
+
+def invalidate_project_role(project_id, user_id, request=None):
+    """
+    Forget a cached role after the user's collaborator entry changed, and
+    have the project's open connections check the user's role again
+    """
+    cache = _role_cache()
+    if cache is not None:
+        # Raises rather than leave a stale role in every worker
+        cache.delete(_cache_key(project_id, user_id))
+    roles = getattr(request, '_project_roles', None)
+    if roles is not None and request.user.id == user_id:
+        roles.pop(str(project_id), None)
+
+    async_to_sync(get_channel_layer().group_send)(
+        f'project_{project_id}',
+        {
+            'type': 'role_changed',
+            'user_id': str(user_id)
+        }
+    )
\ No newline at end of file
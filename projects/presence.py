@@ -0,0 +1,138 @@
+"""
+Who is connected to each project room, tracked in Redis.
+
+Every WebSocket connection is a member of the project's sorted set
+``presence:project:<id>``, scored with the time of its last heartbeat. The
+member is a small JSON document naming the connection and its user, so the
+full active user list comes back from the same pipeline that registers a
+connection. Connections heartbeat every PRESENCE_HEARTBEAT_INTERVAL seconds;
+members older than PRESENCE_TTL (a crashed worker's connections) are
+dropped by whichever connection of the room joins or heartbeats next, which
+also reports their users as left, and the key
+itself expires once a room goes quiet. No key scans are involved, so the
+cost is independent of the number of rooms.
+
+A user is reported as joined when their first connection to a room
+arrives and as left when their last one goes away.
+"""
+
+import json
+import logging
+import time
+import redis.asyncio as redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis errors, plus connection failures raised before redis wraps them
+PresenceError = (redis.RedisError, OSError)
+
+
+def _key(project_id):
+    return f'presence:project:{project_id}'
+
+
+def _decode(members):
+    return [json.loads(member) for member in members]
+
+
+def active_users(members):
+    """Distinct users among presence members, in the order they connected"""
+    users = {}
+    for member in members:
+        users.setdefault(member['user_id'], {'user_id': member['user_id'], 'username': member['username']})
+    return list(users.values())
+
+
+class ProjectPresence:
+    def __init__(self, client, project_id, connection_id, user_id, username, ttl):
+        self.client = client
+        self.key = _key(project_id)
+        self.user_id = str(user_id)
+        self.ttl = ttl
+        self.member = json.dumps(
+            {'connection': connection_id, 'user_id': self.user_id, 'username': username},
+            separators=(',', ':'), sort_keys=True
+        )
+
+    async def join(self):
+        """
+        Register this connection and return ``(members, first, departed)``:
+        everyone present, whether this is the user's first connection to the
+        room, and the users who are gone because their connections expired
+        """
+        now = time.time()
+        cutoff = now - self.ttl
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.zadd(self.key, {self.member: now})
+        pipeline.expire(self.key, int(self.ttl) + 1)
+        pipeline.zrangebyscore(self.key, '-inf', cutoff)
+        pipeline.zrangebyscore(self.key, cutoff, '+inf')
+        *_, stale, members = await pipeline.execute()
+        departed = await self._expire(stale, cutoff)
+        members = _decode(members)
+        first = sum(1 for member in members if member['user_id'] == self.user_id) == 1
+        return members, first, departed
+
+    async def heartbeat(self):
+        """
+        Refresh this connection and expire stale ones; returns the users who
+        are gone as a result
+        """
+        now = time.time()
+        cutoff = now - self.ttl
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.zadd(self.key, {self.member: now})
+        pipeline.expire(self.key, int(self.ttl) + 1)
+        pipeline.zrangebyscore(self.key, '-inf', cutoff)
+        *_, stale = await pipeline.execute()
+        return await self._expire(stale, cutoff)
+
+    async def _expire(self, stale, cutoff):
+        if not stale:
+            return []
+        # ZREM tells exactly one connection that it removed a member, so
+        # each departure is reported once across workers
+        pipeline = self.client.pipeline(transaction=True)
+        for member in stale:
+            pipeline.zrem(self.key, member)
+        pipeline.zrangebyscore(self.key, cutoff, '+inf')
+        *removed, remaining = await pipeline.execute()
+        return self._departed(
+            [member for member, count in zip(_decode(stale), removed) if count],
+            _decode(remaining)
+        )
+
+    async def leave(self):
+        """Unregister this connection; returns whether the user has left the room"""
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.zrem(self.key, self.member)
+        pipeline.zrangebyscore(self.key, time.time() - self.ttl, '+inf')
+        removed, remaining = await pipeline.execute()
+        return bool(removed) and all(member['user_id'] != self.user_id for member in _decode(remaining))
+
+    def _departed(self, removed, remaining):
+        still_here = {member['user_id'] for member in remaining}
+        return active_users(member for member in removed if member['user_id'] not in still_here)
+
+
+_client = None
+
+
+def get_presence_client():
+    """Process-wide Redis client for presence"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.PRESENCE_REDIS_URL, decode_responses=True)
+    return _client
+
+
+def project_presence(project_id, connection_id, user):
+    return ProjectPresence(
+        client=get_presence_client(),
+        project_id=project_id,
+        connection_id=connection_id,
+        user_id=user.id,
+        username=user.username,
+        ttl=settings.PRESENCE_TTL
+    )
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+Code search over a project's files.
+
+Files are indexed into FileSearchTerm rows: every identifier, word and
+number in the content (lowercased, with camelCase and snake_case
+identifiers also split into their parts) and how often it occurs. Terms
+found in the file's path count PATH_WEIGHT times. The index is updated
+incrementally whenever a file is saved through the API, and when the last
+editor of a live editing session closes the file, writing only the terms
+whose counts changed.
+
+A query matches files containing all of its terms. Files are ranked by
+tf-idf over the project, and line snippets are cut from the best matches
+only, so a search reads a few index rows per term plus the content of the
+returned files.
+"""
+
+import math
+import re
+from collections import Counter
+from django.db import transaction
+from .models import File, FileSearchTerm
+
+TOKEN_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|\d+')
+# Boundaries inside identifiers: fooBar, HTTPServer, foo_bar, foo2
+PART_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+MAX_TERM_LENGTH = 64
+PATH_WEIGHT = 5
+MAX_SNIPPETS = 3
+MAX_SNIPPET_LENGTH = 200
+
+
+def tokenize(text):
+    """Index terms of a text, with repeats"""
+    terms = []
+    for token in TOKEN_RE.findall(text):
+        lowered = token.lower()
+        if 1 < len(lowered) <= MAX_TERM_LENGTH:
+            terms.append(lowered)
+        parts = PART_RE.findall(token)
+        if len(parts) > 1:
+            terms.extend(part.lower() for part in parts if 1 < len(part) <= MAX_TERM_LENGTH)
+    return terms
+
+
+def term_counts(path, content):
+    counts = Counter(tokenize(content))
+    for term in tokenize(path):
+        counts[term] += PATH_WEIGHT
+    return counts
+
+
+def index_file(file):
+    """Bring a file's index entries up to date with its content"""
+    index_files([file])
+
+
+def index_files(files):
+    """Update the index entries of several files, writing only what changed"""
+    files = {file.id: file for file in files}
+    if not files:
+        return
+    with transaction.atomic():
+        # Saves of the same file index one after the other, each seeing the
+        # entries the previous one wrote
+        list(File.objects.select_for_update().filter(id__in=list(files)).values_list('id', flat=True))
+        existing = {}
+        for entry in FileSearchTerm.objects.filter(file_id__in=list(files)):
+            existing.setdefault(entry.file_id, {})[entry.term] = entry
+
+        created, updated, removed = [], [], []
+        for file_id, file in files.items():
+            counts = term_counts(file.path, file.content)
+            entries = existing.get(file_id, {})
+            for term, entry in entries.items():
+                if term not in counts:
+                    removed.append(entry.id)
+                elif entry.count != counts[term]:
+                    entry.count = counts[term]
+                    updated.append(entry)
+            created.extend(
+                FileSearchTerm(project_id=file.project_id, file_id=file_id, term=term, count=count)
+                for term, count in counts.items()
+                if term not in entries
+            )
+
+        if removed:
+            FileSearchTerm.objects.filter(id__in=removed).delete()
+        FileSearchTerm.objects.bulk_update(updated, ['count'], batch_size=1000)
+        FileSearchTerm.objects.bulk_create(created, batch_size=1000)
+
+
+def _snippets(content, words):
+    snippets = []
+    for number, line in enumerate(content.splitlines(), start=1):
+        lowered = line.lower()
+        if any(word in lowered for word in words):
+            snippets.append({'line': number, 'text': line.strip()[:MAX_SNIPPET_LENGTH]})
+            if len(snippets) == MAX_SNIPPETS:
+                break
+    return snippets
+
+
+def search_files(project_id, query, limit=20):
+    """Files of a project matching every term of ``query``, best first"""
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+
+    matches = {}
+    document_frequency = Counter()
+    for file_id, term, count in FileSearchTerm.objects.filter(
+        project_id=project_id, term__in=terms
+    ).values_list('file_id', 'term', 'count'):
+        matches.setdefault(file_id, {})[term] = count
+        document_frequency[term] += 1
+    if len(document_frequency) < len(terms):
+        return []
+
+    total = File.objects.filter(project_id=project_id).count()
+    scores = {}
+    for file_id, counts in matches.items():
+        if len(counts) == len(terms):
+            scores[file_id] = sum(
+                (1 + math.log(count)) * math.log(1 + total / document_frequency[term])
+                for term, count in counts.items()
+            )
+    ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+
+    files = File.objects.in_bulk(ranked)
+    # Snippets look for the words as typed, not their split parts
+    words = {word.lower() for word in TOKEN_RE.findall(query)}
+    return [
+        {
+            'file_id': str(file_id),
+            'path': files[file_id].path,
+            'name': files[file_id].name,
+            'score': round(scores[file_id], 4),
+            'snippets': _snippets(files[file_id].content, words)
+        }
+        for file_id in ranked
+        if file_id in files
+    ]
\ No newline at end of file
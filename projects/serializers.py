@@ -1,7 +1,57 @@
 from rest_framework import serializers
+from .bulk import normalize_path
 from .models import Project, ProjectCollaborator, File, FileVersion
 from users.serializers import UserSerializer
 
+def requested_fields(request, param):
+    """
+    Dotted field paths from a comma-separated query parameter, e.g.
+    ``?expand=files,files.versions``
+    """
+    if request is None:
+        return set()
+    value = request.query_params.get(param, '')
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+def _nested(paths, name):
+    prefix = f'{name}.'
+    return {path[len(prefix):] for path in paths if path.startswith(prefix)}
+
+def _select_fields(serializer, fields, expand):
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    if not isinstance(serializer, serializers.Serializer):
+        return
+    
+    # Heavy fields are only included when asked for, directly or through a
+    # nested path such as files.versions
+    expanded = {path.split('.')[0] for path in expand}
+    for name in getattr(serializer.Meta, 'expandable_fields', ()):
+        if name not in expanded:
+            serializer.fields.pop(name, None)
+    
+    selected = {path.split('.')[0] for path in fields}
+    if selected:
+        for name in list(serializer.fields):
+            if name not in selected:
+                serializer.fields.pop(name)
+    
+    for name, field in serializer.fields.items():
+        _select_fields(field, _nested(fields, name), _nested(expand, name))
+
+class FieldSelectionMixin:
+    """
+    Lets clients pick fields with ``?fields=id,name`` and opt into the
+    fields listed in ``Meta.expandable_fields`` with ``?expand=files``.
+    Both accept dotted paths for nested serializers
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        # Only the top-level serializer reads the query parameters
+        if request is not None and self.parent is None:
+            _select_fields(self, requested_fields(request, 'fields'), requested_fields(request, 'expand'))
+
 class ProjectCollaboratorSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     user_id = serializers.UUIDField(write_only=True)
@@ -16,10 +66,18 @@ class FileVersionSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = FileVersion
-        fields = ['id', 'content', 'created_by', 'created_at']
+        fields = ['id', 'created_by', 'created_at']
         read_only_fields = ['id', 'created_at']
 
-class FileSerializer(serializers.ModelSerializer):
+class FileVersionContentSerializer(FileVersionSerializer):
+    # Rebuilding delta-stored content costs a query, so it is only served
+    # for one version at a time
+    content = serializers.CharField(source='full_content', read_only=True)
+    
+    class Meta(FileVersionSerializer.Meta):
+        fields = ['id', 'content', 'created_by', 'created_at']
+
+class FileSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
     versions = FileVersionSerializer(many=True, read_only=True)
     
@@ -27,8 +85,16 @@ class FileSerializer(serializers.ModelSerializer):
         model = File
         fields = ['id', 'name', 'path', 'content', 'created_by', 'created_at', 'updated_at', 'versions']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        expandable_fields = ['versions']
+    
+    def validate_path(self, value):
+        # Stored normalized, so 'a.py', '/a.py' and './a.py' are one file
+        path = normalize_path(value)
+        if path is None:
+            raise serializers.ValidationError('Invalid file path')
+        return path
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
     collaborators = ProjectCollaboratorSerializer(source='projectcollaborator_set', many=True, read_only=True)
     files = FileSerializer(many=True, read_only=True)
@@ -37,7 +103,20 @@ class ProjectSerializer(serializers.ModelSerializer):
         model = Project
         fields = ['id', 'name', 'description', 'owner', 'collaborators', 'files', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        expandable_fields = ['files']
     
     def create(self, validated_data):
         validated_data['owner'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class ProjectListSerializer(ProjectSerializer):
+    # Annotated by ProjectViewSet.get_queryset
+    file_count = serializers.IntegerField(read_only=True)
+    collaborator_count = serializers.IntegerField(read_only=True)
+    
+    class Meta(ProjectSerializer.Meta):
+        fields = [
+            'id', 'name', 'description', 'owner', 'file_count', 'collaborator_count',
+            'collaborators', 'files', 'created_at', 'updated_at'
+        ]
+        expandable_fields = ['collaborators', 'files']
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""
+Line-based deltas between file versions.
+
+A delta is a JSON list of operations applied to the previous version's
+lines: ``n`` copies the next n lines, ``-n`` skips n lines and a list of
+strings inserts those lines. Lines keep their line endings, so joining the
+result reproduces the text exactly.
+"""
+
+import difflib
+import json
+
+
+def _lines(text):
+    return text.splitlines(keepends=True)
+
+
+# Largest (changed old lines x changed new lines) still diffed line by line.
+# SequenceMatcher is quadratic at worst, so bigger changes are stored as a
+# plain replacement, which usually makes the caller keep a full snapshot
+MAX_DIFF_WORK = 4_000_000
+
+
+def make_delta(old, new):
+    """Delta turning ``old`` into ``new``, as a compact JSON string"""
+    old_lines = _lines(old)
+    new_lines = _lines(new)
+
+    # Most edits touch a small region; only that region is diffed
+    prefix = 0
+    limit = min(len(old_lines), len(new_lines))
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+    old_middle = old_lines[prefix:len(old_lines) - suffix]
+    new_middle = new_lines[prefix:len(new_lines) - suffix]
+
+    ops = [prefix] if prefix else []
+    if len(old_middle) * len(new_middle) > MAX_DIFF_WORK:
+        opcodes = [('replace', 0, len(old_middle), 0, len(new_middle))]
+    else:
+        opcodes = difflib.SequenceMatcher(None, old_middle, new_middle, autojunk=False).get_opcodes()
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(-(i2 - i1))
+        if j2 > j1:
+            ops.append(new_middle[j1:j2])
+    if suffix:
+        ops.append(suffix)
+    return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(old, delta):
+    """Rebuild the newer text from ``old`` and a delta made by make_delta"""
+    old_lines = _lines(old)
+    position = 0
+    result = []
+    for op in json.loads(delta):
+        if isinstance(op, list):
+            result.extend(op)
+        elif op >= 0:
+            result.extend(old_lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(result)
\ No newline at end of file
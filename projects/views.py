@@ -1,31 +1,46 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from rest_framework.response import Response
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.utils import timezone
+from django.db.models import Count, Prefetch, Q
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 import json
+import posixpath
 
+from .bulk import BulkUploadError, UploadBatch, iterate_in_thread, normalize_path, stream_zip
 from .models import Project, ProjectCollaborator, File, FileVersion
-from .serializers import ProjectSerializer, ProjectCollaboratorSerializer, FileSerializer, FileVersionSerializer
+from .permissions import EDIT_ROLES, MANAGE_ROLES, get_project_role, invalidate_project_role
+from .search import index_file, index_files, search_files
+from .serializers import (
+    ProjectSerializer, ProjectListSerializer, ProjectCollaboratorSerializer, FileSerializer,
+    FileVersionSerializer, FileVersionContentSerializer, requested_fields
+)
 from users.models import Notification, User
 
 class IsProjectOwnerOrCollaborator(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        # Check if user is the project owner
-        if obj.owner == request.user:
-            return True
+        role = get_project_role(request.user, obj.id, request)
         
-        # Check if user is a collaborator with appropriate role
+        # Any collaborator can read the project
         if view.action in ['retrieve', 'list']:
-            return obj.collaborators.filter(id=request.user.id).exists()
+            return role is not None
         
-        # For update, partial_update, destroy, require admin or editor role
-        return obj.projectcollaborator_set.filter(
-            user=request.user, 
-            role__in=['admin', 'editor']
-        ).exists()
+        # For update, partial_update, destroy, require owner, admin or editor role
+        return role in EDIT_ROLES
+
+class VersionCursorPagination(CursorPagination):
+    page_size = settings.FILE_VERSION_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-created_at'
 
 class ProjectViewSet(viewsets.ModelViewSet):
     serializer_class = ProjectSerializer
@@ -33,19 +48,57 @@ class ProjectViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
-        # Return projects where user is owner or collaborator
-        return Project.objects.filter(
-            Q(owner=user) | Q(collaborators=user)
-        ).distinct()
+        # Return projects where user is owner or collaborator. A subquery
+        # rather than a join keeps the rows distinct for the counts below
+        queryset = Project.objects.filter(
+            Q(owner=user) |
+            Q(id__in=ProjectCollaborator.objects.filter(user=user).values('project_id'))
+        ).select_related('owner')
+        
+        if self.action == 'list':
+            queryset = queryset.annotate(
+                file_count=Count('files', distinct=True),
+                collaborator_count=Count('projectcollaborator', distinct=True)
+            )
+        
+        # Only prefetch the nested data the serializer will render
+        expand = requested_fields(self.request, 'expand')
+        if self.action != 'list' or 'collaborators' in expand:
+            queryset = queryset.prefetch_related(Prefetch(
+                'projectcollaborator_set',
+                queryset=ProjectCollaborator.objects.select_related('user')
+            ))
+        if expand & {'files', 'files.versions'}:
+            queryset = queryset.prefetch_related(Prefetch(
+                'files',
+                queryset=File.objects.select_related('created_by')
+            ))
+        if 'files.versions' in expand:
+            queryset = queryset.prefetch_related(Prefetch(
+                'files__versions',
+                queryset=FileVersion.objects.select_related('created_by')
+            ))
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProjectListSerializer
+        return ProjectSerializer
+    
+    def perform_destroy(self, instance):
+        # Cached roles would otherwise outlive the project
+        project_id = instance.id
+        user_ids = [instance.owner_id, *instance.projectcollaborator_set.values_list('user_id', flat=True)]
+        instance.delete()
+        for user_id in user_ids:
+            invalidate_project_role(project_id, user_id, self.request)
     
     @action(detail=True, methods=['post'])
     def add_collaborator(self, request, pk=None):
         project = self.get_object()
         
         # Only owner or admin can add collaborators
-        if project.owner != request.user and not project.projectcollaborator_set.filter(
-            user=request.user, role='admin'
-        ).exists():
+        if get_project_role(request.user, project.id, request) not in MANAGE_ROLES:
             return Response(
                 {'error': 'Only project owner or admin can add collaborators'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -68,6 +121,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 user=user,
                 defaults={'role': serializer.validated_data.get('role', 'viewer')}
             )
+            invalidate_project_role(project.id, user.id, request)
             
             # Create notification for the added user
             notification = Notification.objects.create(
@@ -103,9 +157,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
         user_id = request.query_params.get('user_id')
         
         # Only owner or admin can remove collaborators
-        if project.owner != request.user and not project.projectcollaborator_set.filter(
-            user=request.user, role='admin'
-        ).exists():
+        if get_project_role(request.user, project.id, request) not in MANAGE_ROLES:
             return Response(
                 {'error': 'Only project owner or admin can remove collaborators'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -114,6 +166,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
         try:
             collaborator = ProjectCollaborator.objects.get(project=project, user_id=user_id)
             collaborator.delete()
+            invalidate_project_role(project.id, collaborator.user_id, request)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except ProjectCollaborator.DoesNotExist:
             return Response(
@@ -127,76 +180,77 @@ class FileViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         project_id = self.kwargs.get('project_pk')
-        return File.objects.filter(project_id=project_id)
+        queryset = File.objects.filter(project_id=project_id).select_related('created_by')
+        if 'versions' in requested_fields(self.request, 'expand'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'versions',
+                queryset=FileVersion.objects.select_related('created_by')
+            ))
+        return queryset
+    
+    def check_can_edit(self, project_id):
+        # Only the owner, admins and editors can change files
+        if get_project_role(self.request.user, project_id, self.request) not in EDIT_ROLES:
+            get_object_or_404(Project, id=project_id)
+            self.permission_denied(self.request)
     
     def perform_create(self, serializer):
         project_id = self.kwargs.get('project_pk')
-        project = get_object_or_404(Project, id=project_id)
         
         # Check if user has permission to create files
-        if project.owner != self.request.user and not project.projectcollaborator_set.filter(
-            user=self.request.user, role__in=['admin', 'editor']
-        ).exists():
-            self.permission_denied(self.request)
+        self.check_can_edit(project_id)
         
-        serializer.save(project=project, created_by=self.request.user)
+        serializer.save(project_id=project_id, created_by=self.request.user)
+        index_file(serializer.instance)
         
         # Create initial version
-        FileVersion.objects.create(
+        FileVersion.objects.create_version(
             file=serializer.instance,
             content=serializer.validated_data.get('content', ''),
             created_by=self.request.user
         )
         
         # Notify collaborators via WebSocket
-        self.notify_file_change(project, serializer.instance, 'created')
+        self.notify_file_change(project_id, serializer.instance, 'created')
     
     def perform_update(self, serializer):
-        file = self.get_object()
-        project = file.project
+        file = serializer.instance
         
         # Check if user has permission to update files
-        if project.owner != self.request.user and not project.projectcollaborator_set.filter(
-            user=self.request.user, role__in=['admin', 'editor']
-        ).exists():
-            self.permission_denied(self.request)
+        self.check_can_edit(file.project_id)
         
         # Create new version if content changed
         old_content = file.content
         new_content = serializer.validated_data.get('content', old_content)
         
         serializer.save()
+        index_file(file)
         
         if old_content != new_content:
-            FileVersion.objects.create(
+            FileVersion.objects.create_version(
                 file=file,
                 content=new_content,
                 created_by=self.request.user
             )
             
             # Notify collaborators via WebSocket
-            self.notify_file_change(project, file, 'updated')
+            self.notify_file_change(file.project_id, file, 'updated')
     
     def perform_destroy(self, instance):
-        project = instance.project
-        
         # Check if user has permission to delete files
-        if project.owner != self.request.user and not project.projectcollaborator_set.filter(
-            user=self.request.user, role__in=['admin', 'editor']
-        ).exists():
-            self.permission_denied(self.request)
+        self.check_can_edit(instance.project_id)
         
         # Notify collaborators before deleting
-        self.notify_file_change(project, instance, 'deleted')
+        self.notify_file_change(instance.project_id, instance, 'deleted')
         
         instance.delete()
     
-    def notify_file_change(self, project, file, action):
+    def notify_file_change(self, project_id, file, action):
         channel_layer = get_channel_layer()
         
         # Send to project group
         async_to_sync(channel_layer.group_send)(
-            f'project_{project.id}',
+            f'project_{project_id}',
             {
                 'type': 'file_event',
                 'event': {
@@ -209,18 +263,182 @@ class FileViewSet(viewsets.ModelViewSet):
             }
         )
     
+    def notify_bulk_change(self, project_id, created, updated):
+        channel_layer = get_channel_layer()
+        
+        # One event for the whole batch rather than one per file
+        async_to_sync(channel_layer.group_send)(
+            f'project_{project_id}',
+            {
+                'type': 'file_event',
+                'event': {
+                    'action': 'bulk_upload',
+                    'files': [
+                        {'file_id': str(file.id), 'file_path': file.path, 'action': action}
+                        for action, files in (('created', created), ('updated', updated))
+                        for file in files
+                    ],
+                    'user_id': str(self.request.user.id),
+                    'username': self.request.user.username
+                }
+            }
+        )
+    
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, MultiPartParser, FormParser])
+    def bulk_upload(self, request, project_pk=None):
+        """
+        Create or update many files at once, from a zip or tar upload in
+        'archive' or a JSON list of {path, content} objects in 'files'
+        """
+        self.check_can_edit(project_pk)
+        
+        batch = UploadBatch()
+        try:
+            if 'archive' in request.FILES:
+                batch.read_archive(request.FILES['archive'])
+            elif 'files' in request.data:
+                batch.read_json(request.data['files'])
+            else:
+                return Response(
+                    {'error': 'Upload an archive or a list of files'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        except BulkUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # A concurrent upload may create one of our new paths first; the
+        # second attempt sees its row and updates it instead
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    existing, created, updated = self.apply_bulk_upload(project_pk, batch, request.user)
+                break
+            except IntegrityError:
+                if attempt:
+                    return Response(
+                        {'error': 'The files were changed by another upload; try again'}, 
+                        status=status.HTTP_409_CONFLICT
+                    )
+        
+        if created or updated:
+            self.notify_bulk_change(project_pk, created, updated)
+        
+        return Response(
+            {
+                'created': len(created),
+                'updated': len(updated),
+                'unchanged': len(existing) - len(updated),
+                'skipped': batch.skipped
+            },
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+    
+    def apply_bulk_upload(self, project_pk, batch, user):
+        # Rows saved before paths were normalized match by their normalized
+        # path too, preferring an exact match, and are saved normalized
+        matches = {}
+        for file_id, stored_path in File.objects.filter(project_id=project_pk).values_list('id', 'path'):
+            path = normalize_path(stored_path)
+            if path in batch.files and (path not in matches or stored_path == path):
+                matches[path] = file_id
+        existing = {
+            normalize_path(file.path): file
+            for file in File.objects.filter(id__in=list(matches.values()))
+        }
+        created = [
+            File(
+                project_id=project_pk,
+                name=posixpath.basename(path),
+                path=path,
+                content=content,
+                created_by=user
+            )
+            for path, content in batch.files.items()
+            if path not in existing
+        ]
+        updated = []
+        now = timezone.now()
+        for path, file in existing.items():
+            if file.content != batch.files[path] or file.path != path:
+                file.content = batch.files[path]
+                file.path = path
+                file.updated_at = now
+                updated.append(file)
+        
+        File.objects.bulk_create(created, batch_size=500)
+        File.objects.bulk_update(updated, ['path', 'content', 'updated_at'], batch_size=500)
+        FileVersion.objects.bulk_create_versions(created + updated, created_by=user)
+        index_files(created + updated)
+        return existing, created, updated
+    
+    @action(detail=False, methods=['get'])
+    def download(self, request, project_pk=None):
+        """Stream every file of the project as a zip archive"""
+        project = get_object_or_404(Project.objects.only('id', 'name'), id=project_pk)
+        if get_project_role(request.user, project.id, request) is None:
+            self.permission_denied(request)
+        
+        files = File.objects.filter(project_id=project.id).order_by('path').values_list('path', 'content')
+        response = StreamingHttpResponse(
+            iterate_in_thread(stream_zip(files.iterator(chunk_size=200))),
+            content_type='application/zip'
+        )
+        filename = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in project.name) or 'project'
+        response['Content-Disposition'] = f'attachment; filename="{filename}.zip"'
+        return response
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request, project_pk=None):
+        """Search the project's files; ?q= is the query, ?limit= caps the results"""
+        project = get_object_or_404(Project.objects.only('id'), id=project_pk)
+        if get_project_role(request.user, project.id, request) is None:
+            self.permission_denied(request)
+        
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'q is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({'query': query, 'results': search_files(project.id, query, limit)})
+    
     @action(detail=True, methods=['get'])
     def versions(self, request, project_pk=None, pk=None):
         file = self.get_object()
-        versions = file.versions.all()
-        serializer = FileVersionSerializer(versions, many=True)
-        return Response(serializer.data)
+        paginator = VersionCursorPagination()
+        page = paginator.paginate_queryset(file.versions.select_related('created_by'), request, view=self)
+        serializer = FileVersionSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    @action(detail=True, methods=['get'], url_path=r'versions/(?P<version_id>[^/.]+)')
+    def version(self, request, project_pk=None, pk=None, version_id=None):
+        file = self.get_object()
+        try:
+            version = file.versions.select_related('created_by').get(id=version_id)
+        except (FileVersion.DoesNotExist, ValidationError):
+            return Response(
+                {'error': 'Version not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        return Response(FileVersionContentSerializer(version).data)
     
     @action(detail=True, methods=['post'])
     def restore_version(self, request, project_pk=None, pk=None):
         file = self.get_object()
         version_id = request.data.get('version_id')
         
+        # Restoring changes the file, so it needs the same role as editing it
+        self.check_can_edit(file.project_id)
+        
         try:
             version = FileVersion.objects.get(id=version_id, file=file)
         except FileVersion.DoesNotExist:
@@ -230,17 +448,18 @@ class FileViewSet(viewsets.ModelViewSet):
             )
         
         # Update file content
-        file.content = version.content
+        file.content = version.full_content
         file.save()
+        index_file(file)
         
         # Create new version to record the restoration
-        new_version = FileVersion.objects.create(
+        new_version = FileVersion.objects.create_version(
             file=file,
-            content=version.content,
+            content=file.content,
             created_by=request.user
         )
         
         # Notify collaborators
-        self.notify_file_change(file.project, file, 'updated')
+        self.notify_file_change(file.project_id, file, 'updated')
         
         return Response(FileVersionSerializer(new_version).data)
\ No newline at end of file